@@ -1,10 +1,14 @@
 from django.contrib import admin
 
-from .models import Player, CheckIn, PageContent, VenueDiscount, ExtraDiscount
+from .models import (Player, CheckIn, PageContent, Standing, VenueDiscount,
+                     ExtraDiscount)
 
 class PlayerAdmin(admin.ModelAdmin):
     list_display = ("player_id", "name", "points", "phone")
-    list_filter = ["name", "date_added"]
+    list_filter = ["name", "season", "date_added"]
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_points()
 
     def player_id(self, obj):
         return str(obj.pid).zfill(3)
@@ -16,6 +20,14 @@ class CheckInAdmin(admin.ModelAdmin):
     list_filter = ["venue", "date", "player"]
 
 
+class StandingAdmin(admin.ModelAdmin):
+    list_display = ("rank", "player", "points", "games", "unique_venues")
+    list_filter = ["season"]
+    list_select_related = ["player"]
+    ordering = ["-season", "rank"]
+    readonly_fields = ("player", "season", "games", "unique_venues", "points", "rank")
+
+
 class VenueDiscountAdmin(admin.ModelAdmin):
     list_display = ("venue", "discount")
 
@@ -28,6 +40,7 @@ class PageContentAdmin(admin.ModelAdmin):
 
 admin.site.register(Player, PlayerAdmin)
 admin.site.register(CheckIn, CheckInAdmin)
+admin.site.register(Standing, StandingAdmin)
 admin.site.register(VenueDiscount, VenueDiscountAdmin)
 admin.site.register(ExtraDiscount, ExtraDiscountAdmin)
 admin.site.register(PageContent, PageContentAdmin)
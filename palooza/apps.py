@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class PaloozaConfig(AppConfig):
     name = 'palooza'
+
+    def ready(self):
+        # connect the signal receivers that maintain the standings table
+        from . import signals
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from palooza.models import Standing
+
+class Command(BaseCommand):
+    help = ("Rebuild the Trivia Palooza standings table from the check-ins, "
+            "reporting any players whose incrementally maintained standing "
+            "didn't match")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help="Only compare the table against a fresh computation; "
+                 "fail if they differ and don't change anything")
+
+    def handle(self, *args, **options):
+        fields = ('season', 'games', 'unique_venues', 'points', 'rank')
+        as_tuple = lambda s: tuple(getattr(s, f) for f in fields)
+
+        with transaction.atomic():
+            expected = {s.player_id: s for s in Standing.objects.compute()}
+            current  = {s.player_id: s
+                        for s in Standing.objects.select_related('player')}
+
+            mismatches = []
+            for player_id in sorted(set(expected) | set(current)):
+                want, have = expected.get(player_id), current.get(player_id)
+                if want is None:
+                    mismatches.append("%s: should not have a standing" % have.player)
+                elif have is None:
+                    mismatches.append("%s: missing standing" % want.player)
+                elif as_tuple(want) != as_tuple(have):
+                    mismatches.append("%s: expected %s, found %s" % (
+                        want.player,
+                        dict(zip(fields, as_tuple(want))),
+                        dict(zip(fields, as_tuple(have)))))
+
+            for line in mismatches:
+                self.stdout.write(line)
+
+            if options['check']:
+                if mismatches:
+                    raise CommandError(
+                        "%d standings don't match the check-ins" % len(mismatches))
+                self.stdout.write("All %d standings match" % len(expected))
+                return
+
+            Standing.objects.rebuild()
+            self.stdout.write("Rebuilt %d standings (%d were out of date)" % (
+                len(expected), len(mismatches)))
@@ -0,0 +1,48 @@
+# Generated by Django 2.2.28 on 2026-10-18 09:06
+
+# The models and columns here were added to the production database before
+# they had a migration. Where they already exist, fake this migration alone:
+#   manage.py migrate palooza 0003_existing_schema --fake
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('website', '0016_existing_schema'),
+        ('palooza', '0002_player_date_added'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExtraDiscount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('discount', models.TextField(max_length=250)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PageContent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=30)),
+                ('content', models.TextField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='player',
+            name='phone',
+            field=models.CharField(blank=True, max_length=15, null=True),
+        ),
+        migrations.CreateModel(
+            name='VenueDiscount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('discount', models.TextField(max_length=250)),
+                ('venue', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='website.Venue')),
+            ],
+        ),
+    ]
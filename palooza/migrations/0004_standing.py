@@ -0,0 +1,56 @@
+# Generated by Django 2.2.28 on 2026-10-18 09:06
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def build_standings(apps, schema_editor):
+    """ Fill the new standings table from the existing check-ins """
+    Player = apps.get_model('palooza', 'Player')
+    Standing = apps.get_model('palooza', 'Standing')
+    players = Player.objects.annotate(
+        total_games=models.Count('checkin'),
+        unique_venues=models.Count('checkin__venue', distinct=True))
+    standings = [
+        Standing(
+            player=p,
+            season=p.date_added.year,
+            games=p.total_games,
+            unique_venues=p.unique_venues,
+            points=p.total_games * (1 + p.unique_venues // 3))
+        for p in players]
+    for s in standings:
+        s.rank = 1 + len([o for o in standings
+                          if o.season == s.season and o.points > s.points])
+    Standing.objects.bulk_create(standings)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('palooza', '0003_existing_schema'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Standing',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('season', models.IntegerField()),
+                ('games', models.IntegerField(default=0)),
+                ('unique_venues', models.IntegerField(default=0)),
+                ('points', models.IntegerField(default=0)),
+                ('rank', models.IntegerField(default=1)),
+                ('player', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='palooza.Player')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='standing',
+            index=models.Index(fields=['season', 'rank'], name='palooza_sta_season_0be133_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='standing',
+            index=models.Index(fields=['season', 'points'], name='palooza_sta_season_ebffb6_idx'),
+        ),
+        migrations.RunPython(build_standings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 2.2.28 on 2026-10-18 09:07
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('website', '0016_existing_schema'),
+        ('palooza', '0004_standing'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CheckInSubmission',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('date', models.DateField()),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('venue', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='website.Venue')),
+            ],
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 2.2.28 on 2026-10-18 09:08
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models.functions import ExtractYear
+import palooza.models
+
+
+def set_seasons(apps, schema_editor):
+    """ Existing players belong to the season they were added in """
+    Player = apps.get_model('palooza', 'Player')
+    Player.objects.update(season=ExtractYear('date_added'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('palooza', '0005_checkinsubmission'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='player',
+            name='season',
+            field=models.IntegerField(db_index=True, default=palooza.models.current_season, editable=False),
+        ),
+        migrations.RunPython(set_seasons, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='checkin',
+            name='player',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='palooza.Player'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='player',
+            unique_together={('pid', 'season')},
+        ),
+        migrations.AddIndex(
+            model_name='checkin',
+            index=models.Index(fields=['player', 'venue', 'date'], name='palooza_che_player__3d4954_idx'),
+        ),
+    ]
@@ -1,19 +1,47 @@
 import math
 
-from django.db import models
+from django.db import connections, models, router
+from django.db.models import (Count, ExpressionWrapper, F, OuterRef,
+                              Subquery)
+from django.db.models.functions import Coalesce
 from datetime  import datetime, date
 
-from website.views import Venue
+from website.cache import invalidate_tags, model_tag
+from website.models import BasePageContent, Venue
+
+class PlayerQuerySet(models.QuerySet):
+    def with_points(self):
+        """ Annotate each player with total_games, unique_venues and
+            total_points, computed by the database in a single query """
+        return self.annotate(
+            total_games=Count('checkin'),
+            unique_venues=Count('checkin__venue', distinct=True),
+        ).annotate(
+            total_points=ExpressionWrapper(
+                F('total_games') * (1 + F('unique_venues') / 3),
+                output_field=models.IntegerField()))
+
+def current_season():
+    return date.today().year
 
 class Player(models.Model):
-    """ A Player for Trivia Palooza """
+    """ A Player for Trivia Palooza
+        Player numbers are handed out again every season, so a pid is only
+        unique within its season """
+    objects = PlayerQuerySet.as_manager()
     pid  =  models.IntegerField()
     name =  models.CharField(max_length=200)
     phone = models.CharField(max_length=15, blank=True, null=True)
     date_added = models.DateField(auto_now_add=True, blank=True)
+    season = models.IntegerField(default=current_season, editable=False,
+                                 db_index=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        unique_together = ('pid', 'season')
 
     def __str__(self):
-        return "%s (%s): %s" % (str(self.pid).zfill(3), self.date_added.year, self.name)
+        return "%s (%s): %s" % (str(self.pid).zfill(3), self.season, self.name)
 
     def padded_id(self):
         return str(self.pid).zfill(3)
@@ -22,6 +50,9 @@ class Player(models.Model):
         return CheckIn.objects.filter(player=self)
 
     def points(self):
+        # players loaded through Player.objects.with_points() already know
+        if hasattr(self, 'total_points'):
+            return self.total_points
         checkins = self.checkins()
         total_games = len(checkins)
         venues = map(lambda x: x.venue, checkins)
@@ -45,17 +76,163 @@ class Player(models.Model):
             'checkins': self.checkins,
             'padded_id': self.padded_id()}
 
+class StandingManager(models.Manager):
+    def add_players(self, players):
+        """ Create (empty) standings for newly added players """
+        self.bulk_create([
+            Standing(player=p, season=p.season) for p in players])
+        self.rerank(set(p.season for p in players))
+
+    def refresh(self, player_ids):
+        """ Recompute the standings of the given players from their check-ins
+            and re-rank the seasons they belong to.
+            Only the given players are recounted; everyone else just gets a
+            new rank """
+        player_ids = set(player_ids)
+        if not player_ids:
+            return
+        checkins = CheckIn.objects.filter(
+            player=OuterRef('player')).order_by().values('player')
+        count = lambda aggregate: Coalesce(Subquery(
+            checkins.annotate(n=aggregate).values('n'),
+            output_field=models.IntegerField()), 0)
+        games  = count(Count('pk'))
+        venues = count(Count('venue', distinct=True))
+
+        standings = self.filter(player__in=player_ids)
+        seasons = set(standings.values_list('season', flat=True))
+        standings.update(
+            games=games,
+            unique_venues=venues,
+            points=ExpressionWrapper(
+                games * (1 + venues / 3),
+                output_field=models.IntegerField()))
+        self.rerank(seasons)
+
+    def rerank(self, seasons):
+        """ Rank every player in the given seasons; tied players share a rank
+            (1, 2, 2, 4, ...).
+            The ranks are worked out with a window function in a single
+            query per season, and only the rows whose rank changed are
+            written, which after a check-in is usually just the players the
+            checked-in players passed """
+        connection = connections[router.db_for_write(self.model)]
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        ranks = """
+            SELECT new_rank, id FROM (
+                SELECT id, "rank",
+                    RANK() OVER (ORDER BY points DESC) AS new_rank
+                FROM {table} WHERE season = %s)
+            WHERE "rank" != new_rank""".format(table=table)
+        update = 'UPDATE {table} SET "rank" = %s WHERE id = %s'.format(
+            table=table)
+        with connection.cursor() as cursor:
+            for season in seasons:
+                cursor.execute(ranks, [season])
+                changed = cursor.fetchall()
+                if changed:
+                    cursor.executemany(update, changed)
+        # these updates don't send post_save
+        invalidate_tags(model_tag(self.model))
+
+    def compute(self):
+        """ Return a list of unsaved standings for every player, computed
+            from scratch from the check-in table """
+        standings = []
+        players = Player.objects.with_points().order_by('-total_points')
+        for player in players:
+            standings.append(Standing(
+                player=player,
+                season=player.season,
+                games=player.total_games,
+                unique_venues=player.unique_venues,
+                points=player.total_points))
+        # players are sorted by points, so a player's rank is one more than
+        # the number of players seen before them in their season, unless
+        # they are tied with the previous player
+        ranks = {}
+        for standing in standings:
+            seen, points, rank = ranks.get(standing.season, (0, None, 0))
+            if standing.points != points:
+                rank = seen + 1
+            standing.rank = rank
+            ranks[standing.season] = (seen + 1, standing.points, rank)
+        return standings
+
+    def rebuild(self):
+        """ Throw away the standings table and recreate it from scratch
+            Return the list of new standings """
+        standings = self.compute()
+        self.all().delete()
+        self.bulk_create(standings)
+        invalidate_tags(model_tag(self.model))
+        return standings
+
+class Standing(models.Model):
+    """ A player's place in the Trivia Palooza standings for a season.
+        This is a materialized view of the CheckIn table that is kept up to
+        date as check-ins are added, edited and deleted (see signals.py) so
+        that the standings page doesn't have to count every check-in """
+    objects = StandingManager()
+    player        = models.OneToOneField("Player", models.CASCADE)
+    season        = models.IntegerField()
+    games         = models.IntegerField(default=0)
+    unique_venues = models.IntegerField(default=0)
+    points        = models.IntegerField(default=0)
+    rank          = models.IntegerField(default=1)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['season', 'rank']),
+            models.Index(fields=['season', 'points']),
+        ]
+
+    def __str__(self):
+        return "%s: #%s (%s points)" % (self.player, self.rank, self.points)
+
+    def to_dict(self):
+        """ converts self to dictionary
+            includes keys: [
+                pid, name, phone, points, rank, padded_id ] """
+        return {
+            'pid': self.player.pid,
+            'name': self.player.name,
+            'phone': self.player.phone,
+            'points': self.points,
+            'rank': self.rank,
+            'padded_id': self.player.padded_id()}
+
 class CheckIn(models.Model):
     """ A CheckIn is created every time a player checks-in at a venue with
         their Trivia Palooza pass """
-    player   = models.ForeignKey("Player", models.CASCADE, blank=False, null=False)
+    # player lookups use the (player, venue, date) index below
+    player   = models.ForeignKey("Player", models.CASCADE, blank=False, null=False,
+                                 db_index=False)
     # Don't allow venues to be deleted if it has CheckIns
     venue = models.ForeignKey(Venue, models.PROTECT, blank=False, null=False)
     date  = models.DateField()
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['player', 'venue', 'date']),
+        ]
 
     def __str__(self):
         return "%s at %s on %s" % (self.player, self.venue, self.date)
 
+class CheckInSubmission(models.Model):
+    """ Record of a batch of check-ins submitted by a host.
+        The key is generated by the host's browser, so if a submission is
+        retried (flaky bar wifi) we can tell that we've already saved it """
+    key     = models.CharField(max_length=64, unique=True)
+    venue   = models.ForeignKey(Venue, models.PROTECT)
+    date    = models.DateField()
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return "Check-ins at %s on %s (%s)" % (self.venue, self.date, self.key)
+
 class VenueDiscount(models.Model):
     """ Special perks/discounts offered to TP players """
     venue    = models.ForeignKey(Venue, models.CASCADE)
@@ -72,6 +249,5 @@ class ExtraDiscount(models.Model):
     def __str__(self):
         return "{} TP-discount".format(self.name)
 
-class PageContent(models.Model):
-    name = models.CharField(max_length=30)
-    content = models.TextField()
+class PageContent(BasePageContent):
+    pass
@@ -0,0 +1,39 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch           import receiver
+
+from .models import CheckIn, Player, Standing
+
+# Keep the Standing table in sync with the CheckIn table.
+# Note: QuerySet.update() and bulk_create() don't send these signals, so code
+# that writes check-ins in bulk has to call Standing.objects.refresh() itself
+
+@receiver(post_save, sender=Player)
+def create_standing(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        Standing.objects.add_players([instance])
+
+@receiver(post_delete, sender=Player)
+def rerank_season(sender, instance, **kwargs):
+    Standing.objects.rerank([instance.season])
+
+@receiver(pre_save, sender=CheckIn)
+def remember_previous_player(sender, instance, raw=False, **kwargs):
+    """ If a check-in is being moved to a different player, the old player
+        needs to lose their points """
+    instance._previous_player_id = None
+    if instance.pk and not raw:
+        instance._previous_player_id = CheckIn.objects.filter(
+            pk=instance.pk).values_list('player', flat=True).first()
+
+@receiver(post_save, sender=CheckIn)
+def update_standings(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    player_ids = {instance.player_id}
+    if getattr(instance, '_previous_player_id', None):
+        player_ids.add(instance._previous_player_id)
+    Standing.objects.refresh(player_ids)
+
+@receiver(post_delete, sender=CheckIn)
+def remove_from_standings(sender, instance, **kwargs):
+    Standing.objects.refresh([instance.player_id])
@@ -1,3 +1,517 @@
-from django.test import TestCase
+import json
+from io import StringIO
+import re
+import threading
+from datetime import date
 
-# Create your tests here.
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, connections
+from django.test import Client, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+
+from website.testing import make_admin, make_host, make_venue, make_venues
+from website.writer import writer
+from .models import CheckIn, CheckInSubmission, Player, Standing
+from .views import AddCheckins
+
+class QueryPlanTests(TestCase):
+    """ Make sure the queries run on every check-in and every standings page
+        load are answered from an index instead of scanning a whole table """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.venues = make_venues(10)
+        # a few seasons worth of players, so there's something to skip over
+        for season in range(2015, date.today().year + 1):
+            cls.players = [
+                Player.objects.create(pid=n, name="Player %d" % n, season=season)
+                for n in range(1, 21)]
+        CheckIn.objects.bulk_create([
+            CheckIn(player=p, venue=v, date=date(2018, 1, d))
+            for p in cls.players
+            for d, v in enumerate(cls.venues[:p.pid % 10], 1)])
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+    def explain(self, sql, params=()):
+        """ Return list of the steps in sqlite's query plan for sql """
+        with connection.cursor() as cursor:
+            cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def explain_queryset(self, queryset):
+        return self.explain(*queryset.query.sql_with_params())
+
+    def assertNoFullScan(self, plan, allowed=()):
+        """ Fail if any step of plan reads every row of a table, other than
+            the tables in allowed """
+        for step in plan:
+            scan = re.match(r'SCAN (TABLE )?(\w+)', step)
+            # 'subquery' is the result of a subquery, not a table
+            if scan and scan.group(2) not in ('subquery',) + tuple(allowed):
+                self.assertRegex(step, r'USING (COVERING )?INDEX',
+                                 "full scan in %s" % plan)
+
+    def test_standings_page(self):
+        standings = Standing.objects.filter(
+            season=date.today().year).select_related('player').order_by(
+            'rank', 'player__name')
+        self.assertNoFullScan(self.explain_queryset(standings))
+
+    def test_checkin_player_lookup(self):
+        players = Player.objects.filter(
+            season=date.today().year, pid__in=[1, 2, 3])
+        self.assertNoFullScan(self.explain_queryset(players))
+
+    def test_checkin_submission_lookup(self):
+        submissions = CheckInSubmission.objects.filter(key__in=['a', 'b'])
+        self.assertNoFullScan(self.explain_queryset(submissions))
+
+    def test_standings_refresh(self):
+        player_ids = [p.pk for p in self.players[:3]]
+        with CaptureQueriesContext(connection) as queries:
+            Standing.objects.refresh(player_ids)
+        updates = [q['sql'] for q in queries if q['sql'].startswith('UPDATE')]
+        self.assertTrue(updates)
+        for sql in updates:
+            self.assertNoFullScan(self.explain(sql))
+
+    def test_checkin_admin_filtered_by_player(self):
+        make_admin(self.client)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                '/triviatimelive/admin/palooza/checkin/',
+                {'player__id__exact': self.players[0].pk})
+        self.assertEqual(response.status_code, 200)
+        selects = [q['sql'] for q in queries
+                   if q['sql'].startswith('SELECT')
+                   and 'FROM "palooza_checkin"' in q['sql']
+                   and 'WHERE' in q['sql']]
+        self.assertTrue(selects)
+        for sql in selects:
+            self.assertNoFullScan(self.explain(sql))
+
+    def test_player_admin_points(self):
+        make_admin(self.client)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/triviatimelive/admin/palooza/player/')
+        self.assertEqual(response.status_code, 200)
+        joins = [q['sql'] for q in queries
+                 if q['sql'].startswith('SELECT')
+                 and 'JOIN "palooza_checkin"' in q['sql']]
+        self.assertTrue(joins)
+        # listing every player has to read every player, but counting their
+        # check-ins shouldn't read every check-in
+        for sql in joins:
+            self.assertNoFullScan(self.explain(sql), allowed=['palooza_player'])
+
+class StandingMaintenanceTests(TestCase):
+    """ The standings are kept up to date as check-ins and players change,
+        and should always match what rebuild_standings would make of them """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.venues = make_venues(4)
+        cls.players = [
+            Player.objects.create(pid=n, name="Player %d" % n, season=2018)
+            for n in range(1, 6)]
+        Player.objects.create(pid=1, name="Last Year", season=2017)
+        for n, player in enumerate(cls.players):
+            for d in range(n + 1):
+                CheckIn.objects.create(
+                    player=player, venue=cls.venues[d % 4],
+                    date=date(2018, 1, d + 1))
+
+    def assertNoDrift(self):
+        call_command('rebuild_standings', check=True, stdout=StringIO())
+
+    def admin_delete(self, model, objects):
+        make_admin(self.client)
+        response = self.client.post(
+            '/triviatimelive/admin/palooza/%s/' % model._meta.model_name,
+            {'action': 'delete_selected', 'post': 'yes',
+             '_selected_action': [o.pk for o in objects]})
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(model.objects.filter(
+            pk__in=[o.pk for o in objects]).exists())
+
+    def test_created(self):
+        self.assertNoDrift()
+        self.assertEqual(Standing.objects.get(player=self.players[0]).rank, 5)
+
+    def test_checked_in_in_bulk(self):
+        AddCheckins().make_checkins(
+            self.venues[1], date(2018, 2, 1), self.players[:3],
+            [{'pidm': 9, 'name': "New"}])
+        self.assertNoDrift()
+
+    def test_checkin_moved_to_another_venue(self):
+        checkin = self.players[4].checkin_set.filter(venue=self.venues[0]).first()
+        checkin.venue = self.venues[3]
+        checkin.save()
+        self.assertNoDrift()
+
+    def test_checkin_moved_to_another_player(self):
+        checkin = self.players[4].checkin_set.first()
+        checkin.player = self.players[0]
+        checkin.save()
+        self.assertNoDrift()
+
+    def test_checkin_deleted(self):
+        self.players[2].checkin_set.first().delete()
+        self.assertNoDrift()
+
+    def test_checkins_deleted_in_bulk(self):
+        CheckIn.objects.filter(venue=self.venues[0]).delete()
+        self.assertNoDrift()
+
+    def test_checkins_deleted_in_admin(self):
+        self.admin_delete(CheckIn, CheckIn.objects.filter(
+            player__in=self.players[3:]))
+        self.assertNoDrift()
+
+    def test_player_edited(self):
+        player = self.players[1]
+        player.name = "Renamed"
+        player.save()
+        self.assertNoDrift()
+
+    def test_player_deleted(self):
+        self.players[4].delete()
+        self.assertNoDrift()
+        self.assertEqual(Standing.objects.get(player=self.players[3]).rank, 1)
+
+    def test_players_deleted_in_admin(self):
+        self.admin_delete(Player, self.players[2:4])
+        self.assertNoDrift()
+
+    def test_drift_is_found(self):
+        Standing.objects.filter(player=self.players[0]).update(points=100)
+        with self.assertRaises(CommandError):
+            self.assertNoDrift()
+
+class RerankTests(TestCase):
+    """ Every check-in re-ranks its season, on the writer thread, so that has
+        to stay cheap however many players there are """
+    players = 2000
+
+    @classmethod
+    def setUpTestData(cls):
+        Player.objects.bulk_create([
+            Player(pid=n, name="Player %d" % n, season=2018)
+            for n in range(cls.players + 1)])
+        # everyone but player 0 has as many points as their number
+        Standing.objects.bulk_create([
+            Standing(player=p, season=2018, points=p.pid,
+                     rank=cls.players + 1 - p.pid if p.pid else cls.players + 1)
+            for p in Player.objects.all()])
+        cls.venues = make_venues(3)
+        cls.player = Player.objects.get(pid=0)
+
+    def changes(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT total_changes()")
+            return cursor.fetchone()[0]
+
+    def test_refresh_only_writes_what_changed(self):
+        # three games at three venues is 6 points: level with player 6, and
+        # ahead of players 1 to 5
+        CheckIn.objects.bulk_create([
+            CheckIn(player=self.player, venue=v, date=date(2018, 1, 1))
+            for v in self.venues])
+        before = self.changes()
+        with CaptureQueriesContext(connection) as queries:
+            Standing.objects.refresh([self.player.pk])
+        # the player's points and rank, and the ranks of the five players
+        # they passed
+        self.assertEqual(self.changes() - before, 2 + 5)
+        self.assertLessEqual(len(queries), 5)
+
+        ranks = dict(Standing.objects.values_list('player__pid', 'rank'))
+        self.assertEqual(ranks[0], self.players - 5)
+        for pid in range(1, 6):
+            self.assertEqual(ranks[pid], self.players + 1 - pid + 1)
+        points = dict(Standing.objects.values_list('player__pid', 'points'))
+        for pid, rank in ranks.items():
+            ahead = sum(1 for p in points.values() if p > points[pid])
+            if rank != ahead + 1:
+                self.fail("#%d is ranked %d, not %d" % (pid, rank, ahead + 1))
+
+    def test_rerank_with_nothing_changed_writes_nothing(self):
+        before = self.changes()
+        Standing.objects.rerank([2018])
+        self.assertEqual(self.changes(), before)
+
+class CheckInTests(TestCase):
+    """ Player numbers are handed out again every season, so check-ins only
+        ever go to this season's holder of a number """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.venue = make_venue()
+        cls.old = Player.objects.create(pid=7, name="Last Year", season=2017)
+        make_host()
+
+    def setUp(self):
+        self.client.login(username='host', password='password')
+
+    def check_in(self, players=(), new_players=()):
+        data = {
+            'venue': 'VEN', 'date': '2018-06-01', 'players': list(players),
+            'newPlayers': [{'pidm': pid, 'name': name}
+                           for pid, name in new_players]}
+        response = self.client.post(
+            '/triviatimelive/triviapalooza/checkins/add',
+            json.dumps(json.dumps(data)), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content.decode('utf-8'))
+
+    def test_last_seasons_number_can_be_given_out_again(self):
+        self.assertEqual(
+            self.check_in(new_players=[(7, "This Year")]), {'success': True})
+        player = Player.objects.get(pid=7, season=2018)
+        self.assertEqual(player.name, "This Year")
+        self.assertEqual(player.checkin_set.count(), 1)
+        self.assertFalse(self.old.checkin_set.exists())
+
+    def test_number_only_used_last_season_is_unknown(self):
+        self.assertIn('error', self.check_in(players=[7]))
+        self.assertFalse(CheckIn.objects.exists())
+
+    def test_checkins_count_towards_this_season(self):
+        current = Player.objects.create(pid=7, name="This Year", season=2018)
+        self.assertEqual(self.check_in(players=[7]), {'success': True})
+        self.assertEqual(Standing.objects.get(player=current).games, 1)
+
+    def test_repeated_numbers(self):
+        self.assertIn('error', self.check_in(
+            new_players=[(8, "Someone"), (8, "Someone Else")]))
+        self.assertEqual(self.check_in(
+            players=[8], new_players=[(8, "Someone"), (8, "someone")]),
+            {'success': True})
+        self.assertEqual(self.check_in(players=[8, 8]), {'success': True})
+        player = Player.objects.get(pid=8)
+        self.assertEqual(player.checkin_set.count(), 2)
+
+class BatchCheckInTests(TestCase):
+    """ The check-ins page re-sends its queue until the server answers it,
+        so one bad submission mustn't fail the whole batch """
+    url = '/triviatimelive/triviapalooza/checkins/batch'
+
+    @classmethod
+    def setUpTestData(cls):
+        make_venue()
+        cls.player = Player.objects.create(pid=1, name="Regular", season=2018)
+        make_host()
+
+    def setUp(self):
+        self.client.login(username='host', password='password')
+
+    def submission(self, key, **data):
+        submission = {'key': key, 'venue': 'VEN', 'date': '2018-06-01',
+                      'players': [1], 'newPlayers': []}
+        submission.update(data)
+        return submission
+
+    def post(self, body):
+        if not isinstance(body, str):
+            body = json.dumps(json.dumps(body))
+        return self.client.post(self.url, body, content_type='application/json')
+
+    def results(self, submissions):
+        response = self.post({'submissions': submissions})
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content.decode('utf-8'))['results']
+
+    def test_replayed_key_is_only_saved_once(self):
+        for _ in range(2):
+            results = self.results([self.submission('a')])
+        self.assertEqual(results, [
+            {'key': 'a', 'success': True, 'duplicate': True}])
+        self.assertEqual(CheckIn.objects.count(), 1)
+        self.assertEqual(CheckInSubmission.objects.count(), 1)
+
+    def test_mixed_batch(self):
+        results = self.results([
+            self.submission('good'),
+            self.submission('unknown player', players=[99]),
+            'not a submission',
+            self.submission('null players', players=None),
+            self.submission('bad new player', newPlayers=[{'pidm': 'x'}]),
+            self.submission('bad venue', venue=['VEN']),
+            self.submission('repeated number', players=[], newPlayers=[
+                {'pidm': 2, 'name': "One"}, {'pidm': 2, 'name': "Two"}]),
+            self.submission('', date='2018-06-02'),
+            self.submission('also good', date='2018-06-03', newPlayers=[
+                {'pidm': 2, 'name': "New"}]),
+        ])
+        self.assertEqual(
+            [(r['key'], r['success']) for r in results],
+            [('good', True), ('unknown player', False), ('', False),
+             ('null players', False), ('bad new player', False),
+             ('bad venue', False), ('repeated number', False), ('', False),
+             ('also good', True)])
+        for result in results:
+            if not result['success']:
+                self.assertTrue(result['error'])
+        self.assertEqual(CheckIn.objects.count(), 3)
+        self.assertEqual(
+            set(CheckInSubmission.objects.values_list('key', flat=True)),
+            {'good', 'also good'})
+
+    def test_malformed_bodies(self):
+        for body in ['', 'not json', '[]', '"[]"', '{"submissions": 1}',
+                     json.dumps(json.dumps({'submissions': {'key': 'a'}}))]:
+            response = self.post(body)
+            self.assertEqual(response.status_code, 400, body)
+            self.assertIn('error', json.loads(response.content.decode('utf-8')))
+        self.assertFalse(CheckIn.objects.exists())
+
+class WriterTests(TransactionTestCase):
+    """ Dozens of hosts sending in their check-ins at once should all get
+        written, in a handful of transactions, without "database is locked" """
+    hosts = 40
+
+    def setUp(self):
+        self.venues = make_venues(self.hosts)
+        self.regulars = [
+            Player.objects.create(pid=n, name="Player %d" % n)
+            for n in range(1, 11)]
+        client = Client()
+        make_host(client)
+        self.cookies = client.cookies
+        self.release = threading.Event()
+        # don't leave the writer stuck if a test fails while holding it
+        self.addCleanup(self.release.set)
+
+    def hold_writer(self):
+        """ Keep the writer busy until self.release is set, so submissions
+            queue up behind it """
+        held = threading.Event()
+
+        def hold():
+            held.set()
+            self.release.wait()
+
+        thread = threading.Thread(target=writer.submit, args=(hold,))
+        thread.start()
+        # or the writer could take what's queued up next in the same batch
+        self.assertTrue(held.wait(5))
+        return thread
+
+    def wait_for_queue(self, length):
+        for _ in range(500):
+            if writer.queue.qsize() >= length:
+                return
+            self.release.wait(0.01)
+        self.fail("only %d of %d submissions queued"
+                  % (writer.queue.qsize(), length))
+
+    def in_threads(self, work, args_list):
+        """ Run work(*args) for each args in its own thread, and return
+            the results in order (or the exceptions raised) """
+        results = [None] * len(args_list)
+
+        def run(i, args):
+            try:
+                results[i] = work(*args)
+            except Exception as e:
+                results[i] = e
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=run, args=(i, args))
+                   for i, args in enumerate(args_list)]
+        for thread in threads:
+            thread.start()
+        return threads, results
+
+    def check_in(self, n, venue):
+        client = Client()
+        client.cookies = self.cookies
+        data = {
+            'venue': venue.code,
+            'date': '%d-06-%02d' % (date.today().year, n % 28 + 1),
+            'players': [p.pid for p in self.regulars[n % 3:n % 3 + 5]],
+            'newPlayers': [
+                {'pidm': 1000 + 2 * n, 'name': "New %d" % (2 * n)},
+                {'pidm': 1001 + 2 * n, 'name': "New %d" % (2 * n + 1)}]}
+        response = client.post(
+            '/triviatimelive/triviapalooza/checkins/add',
+            json.dumps(json.dumps(data)), content_type='application/json')
+        return json.loads(response.content.decode('utf-8'))
+
+    def test_simultaneous_checkins(self):
+        holder = self.hold_writer()
+        batches = writer.batches
+        threads, results = self.in_threads(
+            self.check_in, list(enumerate(self.venues)))
+        self.wait_for_queue(self.hosts)
+        self.release.set()
+        for thread in threads + [holder]:
+            thread.join()
+
+        self.assertEqual(results, [{'success': True}] * self.hosts)
+        # everything that queued up went in together
+        self.assertLessEqual(writer.batches - batches, 2)
+        self.assertEqual(CheckIn.objects.count(), self.hosts * 7)
+        self.assertEqual(Player.objects.count(), 10 + self.hosts * 2)
+        for venue in self.venues:
+            self.assertEqual(venue.checkin_set.count(), 7)
+        for player in Player.objects.all():
+            standing = Standing.objects.get(player=player)
+            self.assertEqual(standing.points, player.points())
+
+    def test_failure_only_rolls_back_its_own_submission(self):
+        def add(n, fail=False):
+            CheckIn.objects.create(
+                player=self.regulars[0], venue=self.venues[n],
+                date=date(2018, 6, 1))
+            if fail:
+                raise ValueError(n)
+            return n
+
+        holder = self.hold_writer()
+        threads, results = self.in_threads(
+            writer.submit, [(add, n, n % 3 == 0) for n in range(9)])
+        self.wait_for_queue(9)
+        self.release.set()
+        for thread in threads + [holder]:
+            thread.join()
+
+        for n, result in enumerate(results):
+            if n % 3 == 0:
+                self.assertIsInstance(result, ValueError)
+            else:
+                self.assertEqual(result, n)
+        self.assertEqual(
+            sorted(CheckIn.objects.values_list('venue__code', flat=True)),
+            ["V%02d" % n for n in range(9) if n % 3])
+
+    def test_batch_retried_when_locked(self):
+        attempts = []
+
+        def add(n, locked=False):
+            CheckIn.objects.create(
+                player=self.regulars[0], venue=self.venues[n],
+                date=date(2018, 6, 1))
+            attempts.append(n)
+            if locked and attempts.count(n) == 1:
+                # as if another process had the write lock
+                raise OperationalError("database is locked")
+            return n
+
+        holder = self.hold_writer()
+        threads, results = self.in_threads(
+            writer.submit, [(add, 0), (add, 1, True), (add, 2)])
+        self.wait_for_queue(3)
+        self.release.set()
+        for thread in threads + [holder]:
+            thread.join()
+
+        self.assertEqual(results, [0, 1, 2])
+        # the batch was rolled back and done again, but only written once
+        self.assertEqual(attempts.count(1), 2)
+        self.assertEqual(
+            sorted(CheckIn.objects.values_list('venue__code', flat=True)),
+            ["V00", "V01", "V02"])
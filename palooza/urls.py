@@ -9,5 +9,6 @@ urlpatterns = [
     path('standings/',   views.Standings.as_view(),   name='standings'),
     path('about/',       views.About.as_view(),       name='about'),
     path('discounts/',   views.Discounts.as_view(),   name='discounts'),
-    path('checkins/add', views.AddCheckins.as_view(), name='checkins_add')
+    path('checkins/add', views.AddCheckins.as_view(), name='checkins_add'),
+    path('checkins/batch', views.AddCheckinsBatch.as_view(), name='checkins_batch'),
 ]
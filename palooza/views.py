@@ -1,12 +1,15 @@
-from itertools import groupby
 from datetime import date
+from django.db import IntegrityError, transaction
 from django.http import HttpResponse
 from django.shortcuts import render
 from django.views  import generic, View
 
+from website.cache import invalidate_tags, model_tag
 from website.views import ContentPage as CP, Login, LoginRequiredMixin
+from website.writer import submit
 from website.models import Venue
-from .models import Player, CheckIn, PageContent, VenueDiscount, ExtraDiscount
+from .models import (Player, CheckIn, CheckInSubmission, PageContent, Standing,
+                     VenueDiscount, ExtraDiscount)
 import json
 
 LOGIN_URL = '/triviatimelive/login/'
@@ -23,30 +26,14 @@ class Standings(ContentPage, generic.ListView):
              "content": "noindex, nofollow"}]}
 
     def get_queryset(self):
-        """ Return all players in the current year """
+        """ Return the standings of all players in the current year """
         today = date.today()
         self.extra_context["years"] = (today.year, today.year + 1)
 
-        players = Player.objects.filter(date_added__year=today.year)
-        player_dicts = [ p.to_dict() for p in players ]
-        return self.rank_players(player_dicts)
-
-    def rank_players(self, players):
-        """ returns a list of player dictionaries sorted by rank and then name
-            all player dictionaries are given a 'rank' value """
-        players_by_points = groupby(
-                sorted(players, key=lambda p: p['points'], reverse=True),
-                key=lambda p: p['points'])
-        new_players_list = []
-        rank = 1
-        for points, players in players_by_points:
-            players = sorted(players, key=lambda p: p['name'])
-            for player in players:
-                player['rank'] = rank
-                new_players_list.append(player)
-            rank += len(players)
-
-        return new_players_list
+        standings = Standing.objects.filter(
+            season=today.year).select_related('player').order_by(
+            'rank', 'player__name')
+        return [ s.to_dict() for s in standings ]
 
 class Discounts(ContentPage, generic.ListView):
     extra_context = {
@@ -102,7 +89,8 @@ class AddCheckins(LoginRequiredMixin, View):
 
         response = {}
         if not cleaned_data.get('error'):
-            self.make_checkins(
+            submit(
+                self.make_checkins,
                 cleaned_data['venue'],
                 cleaned_data['date'],
                 cleaned_data['players'],
@@ -120,6 +108,8 @@ class AddCheckins(LoginRequiredMixin, View):
 
     def clean_data(self, data):
         """ Make sure data is something we can work with """
+        if not isinstance(data, dict):
+            return {'error': 'invalid submission'}
         cleaned_data = {}
         venue_code   = data.get('venue')
         date_string  = data.get('date')
@@ -127,6 +117,8 @@ class AddCheckins(LoginRequiredMixin, View):
         new_players  = data.get('newPlayers')
 
         # Get venue
+        if not isinstance(venue_code, str):
+            return {'error': 'invalid venue'}
         try:
             venue = Venue.objects.get(code=venue_code)
         except Venue.DoesNotExist:
@@ -140,19 +132,12 @@ class AddCheckins(LoginRequiredMixin, View):
             return {'error': 'invalid date'}
 
         # Get existing players
+        if not isinstance(pidms, list) or not isinstance(new_players, list):
+            return {'error': 'invalid list of players'}
         try:
             pidms = [ int(p) for p in pidms ]
-        except ValueError:
+        except (TypeError, ValueError):
             return {'error': 'not a valid number'}
-        # Normally I'd do this in a list comprehension, but it's not possible
-        # to display the faulty pidm that way
-        players = []
-        for p in pidms:
-            try:
-                players.append(Player.objects.get(pid=p))
-            except Player.DoesNotExist:
-                msg = 'no player exists with %s as their number' % p
-                return {'error': msg}
 
         # Get new players
         try:
@@ -160,26 +145,52 @@ class AddCheckins(LoginRequiredMixin, View):
                 {'pidm': int(np['pidm']),
                  'name': np['name'].strip()}
                 for np in new_players]
-        except ValueError:
+        except (TypeError, ValueError, KeyError, AttributeError):
             return {'error': 'invalid new player number'}
 
+        # A number can only be given to one new player, but the same player
+        # may well have been entered twice
+        names = {}
+        for np in new_players:
+            name = names.setdefault(np['pidm'], np['name'])
+            if name.lower() != np['name'].lower():
+                msg = '#{0:0>3} was given to both {1} and {2}'
+                return {'error': msg.format(np['pidm'], name, np['name'])}
+        new_players = [
+            {'pidm': pidm, 'name': name} for pidm, name in names.items()]
+        # and so may a player who's checking in
+        pidms = [ p for p in dict.fromkeys(pidms) if p not in names ]
+
+        # Look up everyone who was submitted with a single query. Numbers
+        # are handed out again every season, so only this season's players
+        # count
+        known_players = self.get_players_by_pid(
+            pidms + [np['pidm'] for np in new_players], checkin_date.year)
+
+        # Normally I'd do this in a list comprehension, but it's not possible
+        # to display the faulty pidm that way
+        players = []
+        for p in pidms:
+            try:
+                players.append(known_players[p])
+            except KeyError:
+                msg = 'no player exists with %s as their number' % p
+                return {'error': msg}
+
         # See if any of the "new players" have already been added
         not_really_new_players = []
         for np in new_players:
-            try:
-                player = Player.objects.get(pid=np['pidm'])
-                if player.name.lower() != np['name'].lower():
-                    msg  = '#{0:0>3} already exists in the database under {1}.'
-                    msg += ' You said "{2}"'
-                    raise ValueError(msg.format(
-                        np['pidm'],
-                        player.name,
-                        np['name']))
-                not_really_new_players.append(player)
-            except Player.DoesNotExist:
-                pass
-            except ValueError as e:
-                return {'error': e.args[0]}
+            player = known_players.get(np['pidm'])
+            if not player:
+                continue
+            if player.name.lower() != np['name'].lower():
+                msg  = '#{0:0>3} already exists in the database under {1}.'
+                msg += ' You said "{2}"'
+                return {'error': msg.format(
+                    np['pidm'],
+                    player.name,
+                    np['name'])}
+            not_really_new_players.append(player)
 
         # If there are  them to the `players` list
         if not_really_new_players:
@@ -193,13 +204,122 @@ class AddCheckins(LoginRequiredMixin, View):
                 'players': players,
                 'new_players': new_players}
 
+    def get_players_by_pid(self, pids, season):
+        """ Return dict of {pid: Player} for the given player numbers in
+            the given season """
+        players = Player.objects.filter(season=season, pid__in=set(pids))
+        return { p.pid: p for p in players }
+
     def make_checkins(self, venue, day, players, new_players):
-        """ Actually save the checkins to the database """
-        for player in players:
-            checkin = CheckIn(venue=venue, date=day, player=player)
-            checkin.save()
-        for np in new_players:
-            player = Player(pid=np['pidm'], name=np['name'])
-            player.save()
-            checkin = CheckIn(venue=venue, date=day, player=player)
-            checkin.save()
+        """ Actually save the checkins to the database
+            Everything is written in bulk inside a single transaction so that
+            a whole night of check-ins costs one commit """
+        with transaction.atomic():
+            if new_players:
+                # players join the season they first check in for, which
+                # isn't this one if the check-ins were held up over new year
+                Player.objects.bulk_create([
+                    Player(pid=np['pidm'], name=np['name'], season=day.year)
+                    for np in new_players])
+                # not every database hands back the ids of bulk-created rows,
+                # so fetch the players we just made
+                created = list(self.get_players_by_pid(
+                    [np['pidm'] for np in new_players], day.year).values())
+                Standing.objects.add_players(created)
+                players = list(players) + created
+
+            CheckIn.objects.bulk_create([
+                CheckIn(venue=venue, date=day, player=player)
+                for player in players])
+            # bulk_create doesn't send post_save, so update the standings and
+            # the cache here
+            Standing.objects.refresh([p.pk for p in players])
+            invalidate_tags(model_tag(Player), model_tag(CheckIn))
+
+class AddCheckinsBatch(AddCheckins):
+    """ Accepts any number of check-in submissions in a single request.
+        The check-ins page queues submissions in the browser while the host is
+        offline and sends them here once it has a connection again.
+        Each submission looks like the data AddCheckins takes, plus a `key`
+        made up by the browser. A key is only ever processed once, so it's
+        safe for the browser to re-send a batch it never got a response for.
+
+        Responds with {"results": [{"key": ..., "success": true}, ...]} with
+        one result per submission, in the order they were sent. A submission
+        that can't be saved gets "success": false and an "error", and never
+        will be, so the page shouldn't send it again. A body that isn't a
+        list of submissions gets a 400 """
+    http_method_names = ['post']
+
+    def post(self, request):
+        try:
+            data = json.loads(request.body.decode('utf-8'))
+            # the page double-encodes its JSON (see AddCheckins.post)
+            if isinstance(data, str):
+                data = json.loads(data)
+        except ValueError:
+            return self.bad_request('invalid JSON')
+        submissions = data.get('submissions') if isinstance(data, dict) else None
+        if not isinstance(submissions, list):
+            return self.bad_request('expected a list of submissions')
+
+        keys = [ str(s.get('key') or '') if isinstance(s, dict) else ''
+                 for s in submissions ]
+        seen = set(CheckInSubmission.objects.filter(
+            key__in=keys).values_list('key', flat=True))
+
+        results = []
+        for key, submission in zip(keys, submissions):
+            if key in seen:
+                result = {'success': True, 'duplicate': True}
+            else:
+                result = self.process_submission(key, submission)
+                if result.get('success'):
+                    seen.add(key)
+            result.setdefault('success', False)
+            result['key'] = key
+            results.append(result)
+
+        return HttpResponse(
+            json.dumps({'results': results}),
+            content_type="application/json")
+
+    def bad_request(self, error):
+        return HttpResponse(
+            json.dumps({'error': error}),
+            content_type="application/json",
+            status=400)
+
+    def process_submission(self, key, submission):
+        """ Validate and save one submission
+            Return dict with either 'success' or 'error' """
+        if not key or len(key) > 64:
+            return {'error': 'invalid submission key'}
+
+        cleaned_data = self.clean_data(submission)
+        if cleaned_data.get('error'):
+            return {'error': cleaned_data['error']}
+
+        try:
+            submit(self.save_submission, key, cleaned_data)
+        except IntegrityError:
+            # another request with the same key may have beaten us to it
+            if CheckInSubmission.objects.filter(key=key).exists():
+                return {'success': True, 'duplicate': True}
+            # or another host may have just added a player with one of the
+            # new players' numbers
+            return {'error': 'a new player number was taken while this was '
+                             'being saved'}
+        return {'success': True}
+
+    def save_submission(self, key, cleaned_data):
+        with transaction.atomic():
+            CheckInSubmission.objects.create(
+                key=key,
+                venue=cleaned_data['venue'],
+                date=cleaned_data['date'])
+            self.make_checkins(
+                cleaned_data['venue'],
+                cleaned_data['date'],
+                cleaned_data['players'],
+                cleaned_data['new_players'])
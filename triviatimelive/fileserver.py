@@ -0,0 +1,209 @@
+""" Serves static and media files in front of Django
+
+FileServer wraps the Django WSGI application and answers requests under
+STATIC_URL and MEDIA_URL straight from the disk, without going through the
+middleware or the url resolver. It supports conditional requests
+(If-None-Match / If-Modified-Since), single byte ranges (Range / If-Range),
+and serves the .br or .gz copy of a file written by collectstatic (see
+website/storage.py) to browsers that accept it. Files are handed to the
+server's wsgi.file_wrapper, which most servers send with sendfile().
+"""
+import mimetypes
+import os
+import re
+import stat
+from wsgiref.headers import Headers
+
+from django.utils.http import http_date, parse_http_date_safe
+
+mimetypes.add_type('font/otf', '.otf')
+mimetypes.add_type('font/ttf', '.ttf')
+mimetypes.add_type('font/woff', '.woff')
+mimetypes.add_type('font/woff2', '.woff2')
+mimetypes.add_type('image/svg+xml', '.svg')
+mimetypes.add_type('image/webp', '.webp')
+
+# names that change whenever their content does: hashed static files
+# (style.1d2c3b4a5e6f.css) and image variants (1d2c3b4a5e6f7a8b-320w.webp)
+IMMUTABLE_NAME = re.compile(r'(\.[0-9a-f]{12}\.[^/.]+|/[0-9a-f]{16}-\d+w\.[^/.]+)$')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'public, max-age=0, must-revalidate'
+
+# best first
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+# what to call a compressed file that was asked for by name (style.css.gz),
+# rather than its content
+COMPRESSED_TYPES = {
+    'br': 'application/x-brotli',
+    'bzip2': 'application/x-bzip2',
+    'gzip': 'application/gzip',
+    'xz': 'application/x-xz',
+}
+
+CHUNK_SIZE = 64 * 1024
+
+class FileServer:
+    def __init__(self, application, roots):
+        """ roots maps url prefixes (e.g. '/static/') to the directories
+            their files are in """
+        self.application = application
+        self.roots = [(prefix, os.path.realpath(root))
+                      for prefix, root in roots.items() if prefix and root]
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        for prefix, root in self.roots:
+            if path.startswith(prefix):
+                return self.serve(environ, start_response, root,
+                                  path[len(prefix):])
+        return self.application(environ, start_response)
+
+    def serve(self, environ, start_response, root, name):
+        if environ['REQUEST_METHOD'] not in ('GET', 'HEAD'):
+            return respond(start_response, '405 Method Not Allowed',
+                           [('Allow', 'GET, HEAD')])
+        path = find(root, name)
+        if path is None:
+            return respond(start_response, '404 Not Found')
+
+        headers = Headers([])
+        content_type, compression = mimetypes.guess_type(path)
+        if compression:
+            content_type = COMPRESSED_TYPES.get(compression)
+        headers['Content-Type'] = content_type or 'application/octet-stream'
+        headers['Cache-Control'] = (
+            IMMUTABLE if IMMUTABLE_NAME.search(name) else REVALIDATE)
+        # whether or not this response is compressed, the same url may be
+        # for another browser, so caches have to keep them apart
+        headers['Vary'] = 'Accept-Encoding'
+        # byte ranges are of the file itself, so don't compress those
+        ranged = 'HTTP_RANGE' in environ
+        encoding = None
+        if not ranged:
+            path, encoding = choose_encoding(
+                path, environ.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding:
+            headers['Content-Encoding'] = encoding
+
+        st = os.stat(path)
+        etag = '"%x-%x%s"' % (int(st.st_mtime), st.st_size,
+                              '-' + encoding if encoding else '')
+        headers['ETag'] = etag
+        headers['Last-Modified'] = http_date(st.st_mtime)
+        headers['Accept-Ranges'] = 'bytes'
+        if not_modified(environ, etag, st.st_mtime):
+            del headers['Content-Type']
+            return respond(start_response, '304 Not Modified', headers.items())
+
+        start, end = 0, st.st_size - 1
+        status = '200 OK'
+        if ranged and if_range_matches(environ, etag, st.st_mtime):
+            byte_range = parse_range(environ['HTTP_RANGE'], st.st_size)
+            if byte_range == 'unsatisfiable':
+                headers['Content-Range'] = 'bytes */%d' % st.st_size
+                return respond(start_response,
+                               '416 Range Not Satisfiable', headers.items())
+            if byte_range:
+                start, end = byte_range
+                status = '206 Partial Content'
+                headers['Content-Range'] = 'bytes %d-%d/%d' % (
+                    start, end, st.st_size)
+        length = end - start + 1
+        headers['Content-Length'] = str(length)
+        start_response(status, headers.items())
+        if environ['REQUEST_METHOD'] == 'HEAD' or length <= 0:
+            return []
+
+        f = open(path, 'rb')
+        f.seek(start)
+        if end == st.st_size - 1:
+            file_wrapper = environ.get('wsgi.file_wrapper')
+            if file_wrapper:
+                return file_wrapper(f, CHUNK_SIZE)
+        return read_chunks(f, length)
+
+def respond(start_response, status, headers=()):
+    headers = list(headers)
+    if not status.startswith('304'):
+        headers.append(('Content-Length', '0'))
+    start_response(status, headers)
+    return []
+
+def find(root, name):
+    """ Return the full path of the file name under root, or None if there
+        isn't one (or name tries to get out of root) """
+    path = os.path.realpath(os.path.join(root, name))
+    if os.path.commonpath([root, path]) != root:
+        return None
+    try:
+        if not stat.S_ISREG(os.stat(path).st_mode):
+            return None
+    except OSError:
+        return None
+    return path
+
+def choose_encoding(path, accept_encoding):
+    """ Return the path of the best precompressed copy of path that the
+        browser accepts, and its encoding, or path and None """
+    accepted = set()
+    for part in accept_encoding.split(','):
+        coding, _, params = part.strip().partition(';')
+        if params.replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        accepted.add(coding.strip().lower())
+    for encoding, extension in ENCODINGS:
+        if encoding in accepted and os.path.isfile(path + extension):
+            return path + extension, encoding
+    return path, None
+
+def not_modified(environ, etag, mtime):
+    if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        tags = [t.strip() for t in if_none_match.split(',')]
+        return '*' in tags or etag in tags or 'W/' + etag in tags
+    since = parse_http_date_safe(environ.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return since is not None and int(mtime) <= since
+
+def if_range_matches(environ, etag, mtime):
+    """ BOOL: False if the Range is conditional on a version of the file
+        other than this one, in which case the whole file is sent """
+    if_range = environ.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == int(mtime)
+
+def parse_range(header, size):
+    """ Return (start, end) of a single byte range, 'unsatisfiable', or None
+        if the header can't be used (in which case the whole file is sent) """
+    units, _, ranges = header.partition('=')
+    if units.strip() != 'bytes' or ',' in ranges:
+        return None
+    first, _, last = ranges.strip().partition('-')
+    try:
+        if not first:
+            # the last n bytes
+            length = int(last)
+            if length <= 0 or size == 0:
+                return 'unsatisfiable'
+            return max(size - length, 0), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        return 'unsatisfiable'
+    if start > end:
+        return None
+    return start, min(end, size - 1)
+
+def read_chunks(f, length):
+    with f:
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
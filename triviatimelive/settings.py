@@ -42,11 +42,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'website.middleware.RequestStatsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'website.middleware.SnapshotMiddleware',
+    'website.middleware.ConditionalPageMiddleware',
+    'website.middleware.PageCacheMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -55,7 +59,8 @@ ROOT_URLCONF = 'triviatimelive.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # Django's backend, plus timing (see website/timing.py)
+        'BACKEND': 'website.timing.TimedDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -79,7 +84,53 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
-    }
+        # keep connections (and their pragmas and page cache) between requests
+        'CONN_MAX_AGE': 600,
+    },
+    # read-only copy of default for public pages; see website/snapshot.py
+    'snapshot': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'db-snapshot.sqlite3'),
+        'CONN_MAX_AGE': 600,
+        'PRAGMAS': {
+            'query_only': 1,
+            'mmap_size': 256 * 1024 * 1024,
+            'cache_size': -20000,
+        },
+        'TEST': {'MIRROR': 'default'},
+    },
+}
+
+DATABASE_ROUTERS = ['website.snapshot.SnapshotRouter']
+
+# Run on every new SQLite connection (see website/sqlite.py)
+SQLITE_PRAGMAS = {
+    # readers don't wait for writers, or writers for readers
+    'journal_mode': 'WAL',
+    # with WAL, only syncs at checkpoints; a power cut can lose the last
+    # few commits but never corrupts the database
+    'synchronous': 'NORMAL',
+    # wait up to 5s for another connection's write to finish
+    'busy_timeout': 5000,
+    'mmap_size': 256 * 1024 * 1024,
+    # negative means KiB rather than pages
+    'cache_size': -20000,
+}
+
+
+# Cache
+# Shared by every process on the server (web workers, cron commands), so that
+# a change saved by any of them rebuilds the cached pages all of them serve
+# (see website/cache.py)
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 5000,
+        },
+    },
 }
 
 
@@ -123,6 +174,67 @@ SITE_ROOT = '/home/shutupmiles/webapps/triviatimelive/ttl-website/'
 
 STATIC_ROOT = SITE_ROOT + "static"
 STATIC_URL = '/static/'
+# `manage.py collectstatic` gives every file a content-hashed name and writes
+# compressed copies of them (see website/storage.py)
+STATICFILES_STORAGE = 'website.storage.CompressedManifestStaticFilesStorage'
 
 MEDIA_ROOT = SITE_ROOT + "media"
 MEDIA_URL  = '/media/'
+
+
+# Trivia Time Live
+
+# Clues older than this many days are deleted by `manage.py prune_clues`
+CLUE_RETENTION_DAYS = 7
+
+# Pages that anonymous visitors are served from the cache (see
+# website/middleware.py), by url name, and the models each is built from.
+# Saving or deleting any of those models rebuilds the page. The query string
+# isn't part of the cache key, so these pages mustn't depend on it
+PAGE_CACHE_MODELS = {
+    'website:index': [
+        'website.announcement', 'website.clue', 'website.event',
+        'website.hold', 'website.pennant', 'website.pennantdistrict',
+        'website.venue'],
+    'website:venues': ['website.hold', 'website.pagecontent', 'website.venue'],
+    'website:pennant_standings': [
+        'website.pagecontent', 'website.pennantdistrict',
+        'website.pennantstandings', 'website.venue'],
+    'website:about': ['website.pagecontent'],
+    'website:how_to_play': ['website.pagecontent'],
+    'palooza:standings': [
+        'palooza.pagecontent', 'palooza.player', 'palooza.standing'],
+    'palooza:discounts': [
+        'palooza.extradiscount', 'palooza.pagecontent',
+        'palooza.venuediscount', 'website.venue'],
+}
+# Longest a page is cached for, in seconds, even if nothing changes
+PAGE_CACHE_TIMEOUT = 24 * 60 * 60
+
+# Pages that answer conditional GETs from the updated_at of the models they're
+# built from (see website/middleware.py), by url name. Every model listed
+# needs an updated_at field. The home page isn't here because its
+# announcements come and go with the time of day
+CONDITIONAL_PAGE_MODELS = {
+    'website:venues': ['website.hold', 'website.pagecontent', 'website.venue'],
+    'website:pennant_standings': [
+        'website.pagecontent', 'website.pennantdistrict',
+        'website.pennantstandings', 'website.venue'],
+    'website:about': ['website.pagecontent'],
+    'website:how_to_play': ['website.pagecontent'],
+    'palooza:standings': [
+        'palooza.checkin', 'palooza.pagecontent', 'palooza.player'],
+    'palooza:about': ['palooza.pagecontent'],
+}
+
+# Pages that anonymous visitors are shown from the database snapshot, which is
+# refreshed by `manage.py refresh_snapshot` (see website/snapshot.py)
+SNAPSHOT_PAGES = [
+    'website:index', 'website:venues', 'website:pennant_standings',
+    'website:about', 'website:how_to_play',
+    'palooza:standings', 'palooza:discounts', 'palooza:about',
+]
+
+# How many of each view's latest requests the request stats page summarizes
+# (see website/timing.py)
+REQUEST_STATS_SAMPLES = 500
@@ -0,0 +1,160 @@
+import gzip
+import os
+import shutil
+import tempfile
+from wsgiref.util import setup_testing_defaults
+
+from django.test import SimpleTestCase
+from django.utils.http import http_date
+
+from .fileserver import FileServer
+
+class FileServerTests(SimpleTestCase):
+    content = b"body { color: #337989; }\n" * 40
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        os.mkdir(os.path.join(self.root, 'static'))
+        self.write('static/style.css', self.content)
+        self.gzipped = gzip.compress(self.content)
+        self.write('static/style.css.gz', self.gzipped)
+        self.write('static/style.css.br', b"not really brotli")
+        self.write('static/archive.css.gz', gzip.compress(self.content))
+        self.write('secret.txt', b"password")
+        self.server = FileServer(self.application, {
+            '/static/': os.path.join(self.root, 'static')})
+
+    def write(self, name, content):
+        with open(os.path.join(self.root, name), 'wb') as f:
+            f.write(content)
+
+    def application(self, environ, start_response):
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return [b"from django"]
+
+    def request(self, path, method='GET', **headers):
+        """ Return the status code, headers and body of a request """
+        environ = {'PATH_INFO': path, 'REQUEST_METHOD': method}
+        environ.update(('HTTP_' + k, v) for k, v in headers.items())
+        setup_testing_defaults(environ)
+        response = {}
+
+        def start_response(status, headers):
+            response['status'] = int(status.split()[0])
+            response['headers'] = dict(headers)
+
+        body = self.server(environ, start_response)
+        try:
+            response['body'] = b"".join(body)
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+        return response['status'], response['headers'], response['body']
+
+    def test_serves_file(self):
+        status, headers, body = self.request('/static/style.css')
+        self.assertEqual(status, 200)
+        self.assertEqual(body, self.content)
+        self.assertEqual(headers['Content-Type'], 'text/css')
+        self.assertEqual(headers['Content-Length'], str(len(self.content)))
+        self.assertEqual(headers['Vary'], 'Accept-Encoding')
+
+    def test_passes_other_paths_on(self):
+        status, _, body = self.request('/index/')
+        self.assertEqual((status, body), (200, b"from django"))
+
+    def test_path_traversal(self):
+        for path in ['/static/../secret.txt', '/static/../../etc/passwd',
+                     '/static//etc/passwd', '/static/missing.css',
+                     '/static/']:
+            status, _, body = self.request(path)
+            self.assertEqual(status, 404, path)
+            self.assertEqual(body, b"")
+
+    def test_method_not_allowed(self):
+        status, headers, _ = self.request('/static/style.css', 'POST')
+        self.assertEqual(status, 405)
+        self.assertEqual(headers['Allow'], 'GET, HEAD')
+
+    def test_head(self):
+        status, headers, body = self.request('/static/style.css', 'HEAD')
+        self.assertEqual(status, 200)
+        self.assertEqual(body, b"")
+        self.assertEqual(headers['Content-Length'], str(len(self.content)))
+
+    def test_range(self):
+        status, headers, body = self.request(
+            '/static/style.css', RANGE='bytes=5-9')
+        self.assertEqual(status, 206)
+        self.assertEqual(body, self.content[5:10])
+        self.assertEqual(headers['Content-Range'],
+                         'bytes 5-9/%d' % len(self.content))
+        self.assertNotIn('Content-Encoding', headers)
+
+    def test_suffix_range(self):
+        status, headers, body = self.request(
+            '/static/style.css', RANGE='bytes=-10', ACCEPT_ENCODING='gzip')
+        self.assertEqual(status, 206)
+        self.assertEqual(body, self.content[-10:])
+        # ranges are of the file itself, never a compressed copy
+        self.assertNotIn('Content-Encoding', headers)
+
+    def test_unsatisfiable_range(self):
+        status, headers, body = self.request(
+            '/static/style.css', RANGE='bytes=%d-' % len(self.content))
+        self.assertEqual(status, 416)
+        self.assertEqual(headers['Content-Range'],
+                         'bytes */%d' % len(self.content))
+        self.assertEqual(body, b"")
+
+    def test_stale_if_range_sends_whole_file(self):
+        status, _, body = self.request(
+            '/static/style.css', RANGE='bytes=5-9', IF_RANGE='"stale"')
+        self.assertEqual((status, body), (200, self.content))
+
+    def test_if_none_match(self):
+        _, headers, _ = self.request('/static/style.css')
+        status, headers, body = self.request(
+            '/static/style.css', IF_NONE_MATCH=headers['ETag'])
+        self.assertEqual((status, body), (304, b""))
+        self.assertNotIn('Content-Type', headers)
+        status, _, _ = self.request(
+            '/static/style.css', IF_NONE_MATCH='"stale"')
+        self.assertEqual(status, 200)
+
+    def test_if_modified_since(self):
+        _, headers, _ = self.request('/static/style.css')
+        status, _, _ = self.request(
+            '/static/style.css', IF_MODIFIED_SINCE=headers['Last-Modified'])
+        self.assertEqual(status, 304)
+        status, _, _ = self.request(
+            '/static/style.css', IF_MODIFIED_SINCE=http_date(0))
+        self.assertEqual(status, 200)
+
+    def test_negotiates_encoding(self):
+        for accept, encoding, body in [
+                ('gzip, deflate, br', 'br', b"not really brotli"),
+                ('gzip, br;q=0', 'gzip', self.gzipped),
+                ('deflate', None, self.content)]:
+            status, headers, content = self.request(
+                '/static/style.css', ACCEPT_ENCODING=accept)
+            self.assertEqual(status, 200)
+            self.assertEqual(headers.get('Content-Encoding'), encoding, accept)
+            self.assertEqual(headers['Content-Type'], 'text/css')
+            self.assertEqual(headers['Vary'], 'Accept-Encoding')
+            self.assertEqual(content, body)
+
+    def test_each_encoding_has_its_own_etag(self):
+        _, plain, _ = self.request('/static/style.css')
+        _, gzipped, _ = self.request(
+            '/static/style.css', ACCEPT_ENCODING='gzip')
+        self.assertNotEqual(plain['ETag'], gzipped['ETag'])
+
+    def test_gz_file_by_name(self):
+        status, headers, body = self.request(
+            '/static/archive.css.gz', ACCEPT_ENCODING='gzip')
+        self.assertEqual(status, 200)
+        self.assertEqual(headers['Content-Type'], 'application/gzip')
+        self.assertNotIn('Content-Encoding', headers)
+        self.assertEqual(gzip.decompress(body), self.content)
@@ -13,12 +13,8 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-from django.conf    import settings
-from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls    import include, path
-from django.conf    import settings
-from django.conf.urls.static import static
 
 
 app_name = 'triviatimelive'
@@ -28,5 +24,4 @@ urlpatterns = [
     path('triviatimelive/', include('website.urls')),
 ]
 
-urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
-urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+# static and media files are served by triviatimelive/fileserver.py
@@ -14,4 +14,12 @@ from django.core.wsgi import get_wsgi_application
 # os.environ.setdefault("DJANGO_SETTINGS_MODULE", "triviatimelive.settings")
 os.environ['DJANGO_SETTINGS_MODULE'] = 'triviatimelive.settings'
 
-application = get_wsgi_application()
+from django.conf import settings
+
+from .fileserver import FileServer
+
+# static and media files are served before a request ever reaches Django
+application = FileServer(get_wsgi_application(), {
+    settings.STATIC_URL: settings.STATIC_ROOT,
+    settings.MEDIA_URL: settings.MEDIA_ROOT,
+})
@@ -27,6 +27,11 @@ class PennantStandingsAdmin(admin.ModelAdmin):
     list_display = ('venue', 'pennant_district', 'win', 'defend', 'place', 'total_points')
     list_filter = ['venue__pennant_district']
 
+    list_select_related = ['venue__pennant_district']
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_total()
+
     def pennant_district(self, obj):
         return obj.venue.pennant_district
 
@@ -35,6 +40,7 @@ class PennantStandingsAdmin(admin.ModelAdmin):
 
     pennant_district.admin_order_field = 'venue__pennant_district'
     pennant_district.short_description = 'Pennant District'
+    total_points.admin_order_field = 'total'
     total_points.short_description = 'Total'
 
 class AnnouncementAdmin(admin.ModelAdmin):
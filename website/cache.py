@@ -0,0 +1,111 @@
+""" Helpers for caching things that are expensive to build """
+from functools import lru_cache
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.cache import cache
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.dispatch import receiver
+from django.urls import URLPattern, URLResolver, get_resolver
+from django.utils import timezone
+
+from . import snapshot
+from .util import seconds_until
+
+def _walk_urlpatterns(patterns, prefix=''):
+    """ Yield a line for every url pattern: its full route and name """
+    for p in patterns:
+        if isinstance(p, URLResolver):
+            namespace = p.namespace + ':' if p.namespace else ''
+            yield from _walk_urlpatterns(
+                p.url_patterns, prefix + namespace + str(p.pattern))
+        elif isinstance(p, URLPattern):
+            yield "%s%s %s" % (prefix, p.pattern, p.name)
+
+@lru_cache(maxsize=None)
+def deployment_version():
+    """ Return a short fingerprint of the url configuration and the static
+        files manifest.
+        Anything cached that has urls or static file names baked into it
+        should include this in its cache key, so that it gets rebuilt after a
+        deploy changes either of them. Both are fixed for the life of the
+        process, so this is only computed once """
+    digest = hashlib.md5()
+    for line in _walk_urlpatterns(get_resolver().url_patterns):
+        digest.update(line.encode('utf-8'))
+    digest.update(settings.STATIC_URL.encode('utf-8'))
+    manifest = getattr(staticfiles_storage, 'manifest_name', None)
+    if manifest and staticfiles_storage.exists(manifest):
+        with staticfiles_storage.open(manifest) as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+@receiver(setting_changed)
+def reset_deployment_version(setting, **kwargs):
+    if setting in ('ROOT_URLCONF', 'STATIC_URL', 'STATICFILES_STORAGE'):
+        deployment_version.cache_clear()
+
+
+# Tags
+# Cached things that are built from the database are stored under keys that
+# include the current "version" of every tag they depend on. A tag is usually
+# a model (see model_tag()), and every time a row of that model is saved or
+# deleted the tag gets a new version (see signals.py), so everything that was
+# built from the old data just stops being found and ages out of the cache.
+# Code that writes with QuerySet.update() or bulk_create() doesn't send
+# signals, so it has to call invalidate_tags() itself
+
+def model_tag(model):
+    return model._meta.label_lower
+
+def tag_versions(tags):
+    """ Return string made of the current version of each tag """
+    keys = ['cache-tag:' + t for t in tags]
+    versions = cache.get_many(keys)
+    missing = [k for k in keys if k not in versions]
+    if missing:
+        # another process may be starting the same tag at the same time, so
+        # only add a version if there still isn't one, and use whichever won
+        for k in missing:
+            cache.add(k, uuid.uuid4().hex[:8], None)
+        versions.update(cache.get_many(missing))
+    return '.'.join(versions.get(k, '') for k in keys)
+
+def tagged_key(prefix, tags, *parts):
+    """ Return cache key that changes whenever any of tags is invalidated,
+        or the database snapshot being read from is refreshed """
+    parts = [prefix, tag_versions(tags)] + [str(p) for p in parts]
+    if snapshot.active_version():
+        parts.append('snapshot-' + snapshot.active_version())
+    return ':'.join(parts)
+
+def invalidate_tags(*tags):
+    """ Give each of tags a new version once the current transaction commits
+        (or right away, outside of one). Until then, anything rebuilt by
+        another request would still be built from the old rows, and would be
+        cached under the new version """
+    versions = { 'cache-tag:' + t: uuid.uuid4().hex[:8] for t in tags }
+    transaction.on_commit(lambda: cache.set_many(versions, None))
+
+
+# Things that go stale at a known time
+
+def cached_until(key, build):
+    """ Return the value cached under key, building and caching it first if
+        there isn't one.
+        build() returns the value and the aware datetime at which it stops
+        being correct (or None if it never does). Cache timeouts are whole
+        seconds, so the expiry is stored alongside the value and checked on
+        every read, so that nothing is served even a moment after it expires """
+    cached = cache.get(key)
+    if cached is not None:
+        value, expires = cached
+        if expires is None or timezone.now() < expires:
+            return value
+    value, expires = build()
+    timeout = None if expires is None else seconds_until(expires)
+    cache.set(key, (value, expires), timeout)
+    return value
@@ -0,0 +1,200 @@
+""" Image processing done when images are uploaded, so that views don't have
+    to touch image files """
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import io
+import json
+import logging
+
+from django.apps import apps
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.utils import timezone
+from PIL import Image, features
+
+from .cache import invalidate_tags, model_tag
+from .writer import submit
+
+def dominant_color(image_file, size=(75, 75), colors=16):
+    """ Return the most common color in an image as a string like
+        '(51, 121, 137)'
+        The image is shrunk and quantized down to a small palette (both done
+        in C by PIL) so that similar shades are counted as the same color """
+    with Image.open(image_file) as im:
+        im = im.convert('RGB').resize(size, Image.BILINEAR)
+    if hasattr(image_file, 'seek'):
+        # leave the file ready to be read again (e.g. saved to storage)
+        image_file.seek(0)
+    quantized = im.quantize(colors=colors)
+    count, index = max(quantized.getcolors())
+    palette = quantized.getpalette()
+    return str(tuple(palette[index * 3:index * 3 + 3]))
+
+# Resized copies ("variants") of uploaded images
+# Every image field listed in a model's `image_variant_widths` gets webp and
+# jpeg/png copies at each of the given widths, so that pages can offer phones
+# something smaller than the original upload. The copies are described by json
+# in a `<field>_variants` text field next to the image field, and are named
+# after a hash of their contents so they can be cached forever. Objects with
+# the same image share its variants, so a variant is only deleted once no
+# object uses it (see delete_unused_variants())
+
+VARIANTS_DIR = 'images/variants/'
+ENCODER_OPTIONS = {
+    'WEBP': {'quality': 80, 'method': 4},
+    'JPEG': {'quality': 82, 'optimize': True, 'progressive': True},
+    'PNG':  {'optimize': True},
+}
+
+logger = logging.getLogger(__name__)
+# a single worker, so uploads are processed one at a time, in order
+_executor = ThreadPoolExecutor(max_workers=1)
+
+def load_variants(variants_json):
+    """ Return dict stored in a *_variants field ({} if there isn't one) """
+    try:
+        return json.loads(variants_json) if variants_json else {}
+    except ValueError:
+        return {}
+
+def variant_names(variants):
+    """ Return set of the file names of the variants in a dict returned by
+        load_variants() """
+    return { name for key in ('webp', 'fallback')
+             for _, name in variants.get(key) or [] }
+
+def make_variants(image_file, widths):
+    """ Save a resized copy of image_file at each of widths (never making it
+        bigger than the original) as webp and as jpeg (png if it's
+        transparent).
+        Return dict describing the copies, like
+            {'source': 'images/venues/logos/logo.png',
+             'webp': [[160, 'images/variants/2b9d...-160w.webp'], ...],
+             'fallback': [[160, 'images/variants/57ac...-160w.png'], ...]} """
+    with Image.open(image_file) as im:
+        im.load()
+    transparent = (im.mode in ('RGBA', 'LA')
+                   or (im.mode == 'P' and 'transparency' in im.info))
+    im = im.convert('RGBA' if transparent else 'RGB')
+    fallback = 'PNG' if transparent else 'JPEG'
+    formats = {'fallback': fallback}
+    if features.check('webp'):
+        formats['webp'] = 'WEBP'
+
+    variants = {'source': image_file.name}
+    for key, fmt in formats.items():
+        variants[key] = []
+        for width in sorted(set(min(w, im.width) for w in widths)):
+            height = max(1, round(im.height * width / im.width))
+            buf = io.BytesIO()
+            im.resize((width, height), Image.LANCZOS).save(
+                buf, fmt, **ENCODER_OPTIONS[fmt])
+            data = buf.getvalue()
+            name = "%s%s-%dw.%s" % (
+                VARIANTS_DIR, hashlib.sha1(data).hexdigest()[:16], width,
+                'jpg' if fmt == 'JPEG' else fmt.lower())
+            if not default_storage.exists(name):
+                name = default_storage.save(name, ContentFile(data))
+            variants[key].append([width, name])
+    return variants
+
+def build_variants(model_label, pk, field, force=False):
+    """ (Re)build the variants of one image field of one object, unless they
+        are already up to date """
+    model = apps.get_model(model_label)
+    instance = model.objects.filter(pk=pk).first()
+    if instance is None:
+        return
+    image = getattr(instance, field)
+    variants_field = field + '_variants'
+    built = load_variants(getattr(instance, variants_field))
+    if not image:
+        variants = {}
+    elif force or built.get('source') != image.name:
+        with image.open('rb'):
+            variants = make_variants(image, model.image_variant_widths[field])
+    else:
+        return
+    # update() rather than save() so we don't end up right back here, which
+    # means doing what save() would have for the cache and updated_at
+    submit(model.objects.filter(pk=pk).update, **{
+        variants_field: json.dumps(variants) if variants else '',
+        'updated_at': timezone.now()})
+    invalidate_tags(model_tag(model))
+    # the variants of the image this one replaced
+    delete_unused_variants(variant_names(built) - variant_names(variants))
+
+def delete_unused_variants(names):
+    """ Delete the variant files in names that no object uses any more """
+    names = set(names)
+    for model in apps.get_models():
+        for field in getattr(model, 'image_variant_widths', None) or {}:
+            for name in list(names):
+                if model.objects.filter(**{
+                        field + '_variants__contains': name}).exists():
+                    names.discard(name)
+    for name in names:
+        default_storage.delete(name)
+
+def _in_background(function, *args):
+    try:
+        function(*args)
+    except Exception:
+        logger.exception("%s%s failed", function.__name__, args)
+    finally:
+        # this thread's database connection isn't managed by a request
+        connection.close()
+
+def schedule_variants(instance, field):
+    """ Build the variants of instance's image field in a background thread
+        once the current transaction has been committed """
+    args = (instance._meta.label, instance.pk, field)
+    transaction.on_commit(
+        lambda: _executor.submit(_in_background, build_variants, *args))
+
+def schedule_variant_deletion(instance):
+    """ Delete the variants of a deleted object's images in a background
+        thread once the current transaction has been committed, unless
+        another object uses them too """
+    names = set()
+    for field in instance.image_variant_widths:
+        names |= variant_names(
+            load_variants(getattr(instance, field + '_variants')))
+    if names:
+        transaction.on_commit(lambda: _executor.submit(
+            _in_background, delete_unused_variants, names))
+
+def srcset(variants_json):
+    """ Return dict for templates with 'webp' and 'fallback' srcset strings
+        and 'src', the url of the smallest fallback.
+        Return {} if there are no variants """
+    variants = load_variants(variants_json)
+    if not variants.get('fallback'):
+        return {}
+    url = default_storage.url
+    as_srcset = lambda key: ", ".join(
+        "%s %dw" % (url(name), width) for width, name in variants.get(key, []))
+    return {
+        'webp': as_srcset('webp'),
+        'fallback': as_srcset('fallback'),
+        'src': url(variants['fallback'][0][1])}
+
+def image_set(variants_json, max_width):
+    """ Return css image-set() of the largest variants no wider than
+        max_width, or None if there are no variants """
+    variants = load_variants(variants_json)
+    types = {'webp': 'image/webp'}
+    if variants.get('fallback'):
+        types['fallback'] = 'image/png' if variants['fallback'][0][1].endswith(
+            '.png') else 'image/jpeg'
+    candidates = []
+    for key, mime in types.items():
+        sizes = variants.get(key) or []
+        fitting = [s for s in sizes if s[0] <= max_width] or sizes[:1]
+        if fitting:
+            candidates.append('url("%s") type("%s")' % (
+                default_storage.url(fitting[-1][1]), mime))
+    if not candidates:
+        return None
+    return "image-set(%s)" % ", ".join(candidates)
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+from website.models import Event
+from website.writer import submit
+
+class Command(BaseCommand):
+    help = "Compute the background colors of events uploaded before they were stored"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help="Recompute every event's colors, not just missing ones")
+
+    def handle(self, *args, **options):
+        has_image = lambda field: ~Q(**{field: ''}) & Q(**{field + '__isnull': False})
+        needs_color = lambda field: has_image(field) & (
+            Q() if options['all'] else Q(**{field + '_color': ''}))
+        events = Event.objects.filter(
+            needs_color('bg_desktop') | needs_color('bg_mobile'))
+
+        for event in events:
+            event.update_bg_colors(force=True)
+            # update() rather than save() so the event's announcement is
+            # left alone
+            submit(Event.objects.filter(pk=event.pk).update,
+                   bg_desktop_color=event.bg_desktop_color,
+                   bg_mobile_color=event.bg_mobile_color,
+                   updated_at=timezone.now())
+            self.stdout.write("%s: desktop %s, mobile %s" % (
+                event.title,
+                event.bg_desktop_color or '-',
+                event.bg_mobile_color or '-'))
@@ -0,0 +1,72 @@
+from datetime import date, time, timedelta
+import timeit
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from website.models import Hold, Pennant, PennantDistrict, Venue
+from website.schedule import Schedule, daterange
+
+class Command(BaseCommand):
+    help = ("Time working out every venue's games over a range of days, one "
+            "venue at a time and with website.schedule.Schedule. "
+            "The venues are made up for the benchmark and rolled back afterwards")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--venues', type=int, default=2000)
+        parser.add_argument('--days', type=int, default=90)
+        parser.add_argument(
+            '--skip-per-venue', action='store_true',
+            help="Only time the schedule, which is much faster")
+
+    def handle(self, *args, **options):
+        start = date.today()
+        end = start + timedelta(days=options['days'] - 1)
+        with transaction.atomic():
+            self.make_venues(options['venues'], start)
+            if not options['skip_per_venue']:
+                self.time("per venue", lambda: self.per_venue(start, end))
+            self.time("schedule", lambda: Schedule(start, end).games())
+            transaction.set_rollback(True)
+
+    def time(self, name, build):
+        queries = []
+        def count(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+        with connection.execute_wrapper(count):
+            seconds = timeit.timeit(build, number=1)
+        self.stdout.write("%-10s %8.3fs %8d queries" % (
+            name, seconds, len(queries)))
+
+    def make_venues(self, count, start):
+        """ Add count venues spread over the week, a fifth of them on hold
+            for the next month and one pennant for every 50 of them """
+        districts = []
+        for n in range(max(count // 50, 1)):
+            district = PennantDistrict.objects.create(name="Benchmark %d" % n)
+            Pennant.objects.create(district=district, next_game=start)
+            districts.append(district)
+        Venue.objects.bulk_create([
+            Venue(name="Benchmark %d" % n, code="B%02d" % (n % 100),
+                  day=n % 7, time=time(18 + n % 3),
+                  address="123 Fake St\nPoulsbo, WA",
+                  pennant_district=districts[n % len(districts)],
+                  has_pennant=n < len(districts))
+            for n in range(count)])
+        venues = Venue.objects.filter(name__startswith="Benchmark ")
+        Hold.objects.bulk_create([
+            Hold(venue=v, start=start, end=start + timedelta(days=30))
+            for v in venues[::5]])
+
+    def per_venue(self, start, end):
+        """ The way the home page and FB posts used to do it """
+        games = {}
+        for day in daterange(start, end):
+            venues = Venue.objects.filter(
+                day=day.weekday()).order_by("time", "name")
+            games[day] = [
+                (v, v.has_pennant and v.pennant_district.pennant.next_game == day)
+                for v in venues
+                if not v.active_hold() or day > v.hold.end]
+        return games
@@ -0,0 +1,110 @@
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from website.sqlite import set_pragmas
+
+READ = """
+    SELECT player_id, COUNT(*) AS games, COUNT(DISTINCT venue_id) AS venues
+    FROM checkin GROUP BY player_id ORDER BY games DESC LIMIT 50"""
+WRITE = "INSERT INTO checkin (player_id, venue_id, date) VALUES (?, ?, ?)"
+
+class Command(BaseCommand):
+    help = ("Measure how many standings-like reads and check-in-like writes a "
+            "scratch SQLite database handles at once: first with SQLite's "
+            "defaults and a new connection for every request, then with "
+            "settings.SQLITE_PRAGMAS and persistent connections")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=8)
+        parser.add_argument('--writers', type=int, default=2)
+        parser.add_argument('--seconds', type=float, default=5)
+        parser.add_argument('--rows', type=int, default=20000)
+
+    def handle(self, *args, **options):
+        runs = [
+            ("before", {}, False),
+            ("after", settings.SQLITE_PRAGMAS, True),
+        ]
+        for name, pragmas, persistent in runs:
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, 'benchmark.sqlite3')
+                self.make_database(path, options['rows'])
+                reads, writes, errors = self.run(path, pragmas, persistent, options)
+            seconds = options['seconds']
+            self.stdout.write(
+                "%-6s %8.1f reads/s %8.1f writes/s %6d errors" % (
+                    name, reads / seconds, writes / seconds, errors))
+
+    def make_database(self, path, rows):
+        db = sqlite3.connect(path)
+        db.execute("""CREATE TABLE checkin (
+            id INTEGER PRIMARY KEY, player_id INTEGER, venue_id INTEGER,
+            date TEXT)""")
+        db.execute("CREATE INDEX checkin_player ON checkin (player_id, venue_id, date)")
+        db.executemany(WRITE, (self.checkin() for _ in range(rows)))
+        db.commit()
+        db.close()
+
+    def checkin(self):
+        return (random.randint(1, 500), random.randint(1, 30),
+                '2018-%02d-%02d' % (random.randint(1, 12), random.randint(1, 28)))
+
+    def run(self, path, pragmas, persistent, options):
+        """ Return the number of reads, writes and errors done by the reader
+            and writer threads in options['seconds'] """
+        deadline = time.monotonic() + options['seconds']
+        counts = { 'reads': 0, 'writes': 0, 'errors': 0 }
+        lock = threading.Lock()
+
+        def connect():
+            db = sqlite3.connect(path, isolation_level=None)
+            set_pragmas(db, pragmas)
+            return db
+
+        def work(operation, counter):
+            db = connect() if persistent else None
+            while time.monotonic() < deadline:
+                conn = db or connect()
+                try:
+                    operation(conn)
+                    outcome = counter
+                except sqlite3.OperationalError:
+                    outcome = 'errors'
+                finally:
+                    if not persistent:
+                        conn.close()
+                with lock:
+                    counts[outcome] += 1
+            if db:
+                db.close()
+
+        def read(db):
+            db.execute(READ).fetchall()
+
+        def write(db):
+            # about as many rows as a night's check-ins at one venue
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                db.executemany(WRITE, (self.checkin() for _ in range(20)))
+                db.execute("COMMIT")
+            except sqlite3.Error:
+                db.execute("ROLLBACK")
+                raise
+
+        threads = (
+            [threading.Thread(target=work, args=(read, 'reads'))
+             for _ in range(options['readers'])] +
+            [threading.Thread(target=work, args=(write, 'writes'))
+             for _ in range(options['writers'])])
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return counts['reads'], counts['writes'], counts['errors']
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from website.views import FBPost
+
+class Command(BaseCommand):
+    help = ("Build and cache the FB posts for the next seven days, and print "
+            "them")
+
+    def handle(self, *args, **options):
+        for day, post in sorted(FBPost().get_posts().items()):
+            self.stdout.write(day.strftime("%A, %B %d"))
+            if post:
+                self.stdout.write(post['string'])
+            else:
+                self.stdout.write("No clue yet")
+            self.stdout.write("")
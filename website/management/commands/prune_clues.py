@@ -0,0 +1,21 @@
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from website.models import Clue
+from website.writer import submit
+
+class Command(BaseCommand):
+    help = ("Delete clues older than settings.CLUE_RETENTION_DAYS. "
+            "Meant to be run daily (e.g. from cron) shortly after midnight")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=settings.CLUE_RETENTION_DAYS,
+            help="Keep clues from this many days back (default: %(default)s)")
+
+    def handle(self, *args, **options):
+        cutoff = date.today() - timedelta(days=options['days'])
+        deleted, _ = submit(Clue.objects.filter(date__lt=cutoff).delete)
+        self.stdout.write("Deleted %d clue(s) from before %s" % (deleted, cutoff))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from website import snapshot
+
+class Command(BaseCommand):
+    help = ("Copy the database to the read-only snapshot that public pages "
+            "are shown from. Run it every few minutes")
+
+    def handle(self, *args, **options):
+        snapshot.refresh()
@@ -0,0 +1,25 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+
+from website.images import build_variants
+
+class Command(BaseCommand):
+    help = "Rebuild the resized copies of every uploaded venue logo and event background"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--missing', action='store_true',
+            help="Only build variants for images that don't have any yet")
+
+    def handle(self, *args, **options):
+        for model in apps.get_app_config('website').get_models():
+            widths = getattr(model, 'image_variant_widths', None)
+            if not widths:
+                continue
+            for obj in model.objects.all():
+                for field in widths:
+                    if not getattr(obj, field):
+                        continue
+                    build_variants(model._meta.label, obj.pk, field,
+                                   force=not options['missing'])
+                    self.stdout.write("%s: %s" % (obj, field))
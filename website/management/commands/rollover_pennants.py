@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from website.models import Pennant
+from website.writer import submit
+
+class Command(BaseCommand):
+    help = ("Move each pennant's next game to its venue's next game once the "
+            "current one has been played. "
+            "Meant to be run daily (e.g. from cron) shortly after midnight")
+
+    def handle(self, *args, **options):
+        moved = submit(Pennant.objects.rollover)
+        self.stdout.write("Moved the next game of %d pennant(s)" % moved)
@@ -0,0 +1,14 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from website.models import Hold
+from website.writer import submit
+
+class Command(BaseCommand):
+    help = ("Delete holds that have ended. "
+            "Meant to be run daily (e.g. from cron) shortly after midnight")
+
+    def handle(self, *args, **options):
+        deleted, _ = submit(Hold.objects.filter(end__lt=date.today()).delete)
+        self.stdout.write("Deleted %d expired hold(s)" % deleted)
@@ -0,0 +1,224 @@
+""" Middleware for serving public pages without rebuilding them, and for
+finding out which ones are slow """
+from contextlib import ExitStack
+from datetime import timedelta
+import hashlib
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, router
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.dateparse import parse_datetime
+from django.utils.http import http_date, quote_etag
+
+from . import snapshot, timing
+from .cache import deployment_version, tagged_key
+from .util import end_of_day, seconds_until
+
+class RequestStatsMiddleware:
+    """ Measures every request to a named url: how long it took, how many
+        queries it made and how long they took, how long its templates took
+        to render (including any queries run from them), and how big the
+        response was. The measurements are summarized by view on the request
+        stats page (see timing.py).
+        A logged-in user can send a "X-Request-Stats: 1" header to get the
+        request's measurements back in the same header.
+        Queries run for a request by the writer thread (see writer.py) only
+        count towards its total time.
+        Should come first, so that it times the rest of the middleware too """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        measured = timing.start()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(measured.execute))
+                response = self.get_response(request)
+        finally:
+            timing.stop()
+        measured.finish(response)
+
+        match = request.resolver_match
+        if match and match.view_name:
+            timing.record(match.view_name, measured)
+        user = getattr(request, 'user', None)
+        if (request.META.get('HTTP_X_REQUEST_STATS')
+                and user is not None and user.is_authenticated):
+            response['X-Request-Stats'] = measured.as_header()
+        return response
+
+class SnapshotMiddleware:
+    """ Anonymous GETs of the pages named in settings.SNAPSHOT_PAGES read
+        from the database snapshot, if there is one (see snapshot.py).
+        Must come after AuthenticationMiddleware and before the rest of the
+        middleware here """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        try:
+            return self.get_response(request)
+        finally:
+            snapshot.deactivate()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if (request.method in ('GET', 'HEAD')
+                and not request.user.is_authenticated
+                and request.resolver_match.view_name in settings.SNAPSHOT_PAGES):
+            snapshot.activate()
+        return None
+
+class ConditionalPageMiddleware:
+    """ Answers conditional GETs (If-None-Match and If-Modified-Since) for the
+        pages named in settings.CONDITIONAL_PAGE_MODELS with a 304, before
+        their views run.
+        A page's validators come from the models it's built from: the latest
+        updated_at and the number of rows (so that deletes count too) of
+        each, read with a single query, plus today's date and who's asking.
+        Code that writes with QuerySet.update() has to set updated_at itself.
+        Must come after AuthenticationMiddleware and before
+        PageCacheMiddleware """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        validators = getattr(request, '_page_validators', None)
+        if validators and response.status_code == 200:
+            etag, last_modified = validators
+            response['ETag'] = etag
+            response['Last-Modified'] = http_date(last_modified.timestamp())
+            # browsers should always ask, rather than guess how long the page
+            # is good for
+            patch_cache_control(response, no_cache=True)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return None
+        labels = settings.CONDITIONAL_PAGE_MODELS.get(
+            request.resolver_match.view_name)
+        if labels is None:
+            return None
+        etag, last_modified = page_validators(labels, request)
+        request._page_validators = (etag, last_modified)
+        return get_conditional_response(
+            request, etag=etag, last_modified=last_modified.timestamp())
+
+def page_validators(labels, request):
+    """ Return ETag and last modified datetime of a page built from the models
+        with the given labels """
+    today = timezone.localdate()
+    models = [apps.get_model(label) for label in labels]
+    # the same database the page will be read from
+    connection = connections[router.db_for_read(models[0])]
+    quote = connection.ops.quote_name
+    columns = []
+    for model in models:
+        table = quote(model._meta.db_table)
+        columns.append('(SELECT MAX(%s) FROM %s)' % (quote('updated_at'), table))
+        columns.append('(SELECT COUNT(*) FROM %s)' % table)
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT ' + ', '.join(columns))
+        row = cursor.fetchone()
+
+    # pages can change at midnight without anything being saved
+    last_modified = end_of_day(today - timedelta(days=1))
+    for value in row[::2]:
+        if isinstance(value, str):
+            value = parse_datetime(value)
+        if value and timezone.is_naive(value):
+            value = timezone.make_aware(value, timezone.utc)
+        if value and value > last_modified:
+            last_modified = value
+
+    # http dates are only good to the second
+    last_modified = last_modified.replace(microsecond=0)
+
+    digest = hashlib.md5()
+    for part in (deployment_version(), today, request.user.pk) + tuple(row):
+        digest.update(str(part).encode('utf-8'))
+    return quote_etag(digest.hexdigest()), last_modified
+
+class PageCacheMiddleware:
+    """ Caches whole responses to anonymous GET requests for the pages named
+        in settings.PAGE_CACHE_MODELS.
+        Each page is cached under a key tagged with the models it's built from
+        (see cache.py), so saving or deleting any of them rebuilds it. Pages
+        are also rebuilt every midnight, and a view can rebuild its page
+        sooner by setting response.cache_until to an aware datetime.
+        Pages are cached by path alone: none of them read the query string,
+        and keying on it would let any made-up one (or Facebook's per-click
+        fbclid) add another copy of the page to the cache.
+        Logged-in users always get a freshly rendered page.
+        Must come after AuthenticationMiddleware """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        key = getattr(request, '_page_cache_key', None)
+        if key and self.is_cacheable(request, response):
+            expires = end_of_day(timezone.localdate())
+            cache_until = getattr(response, 'cache_until', None)
+            if cache_until and cache_until < expires:
+                expires = cache_until
+            timeout = min(seconds_until(expires), settings.PAGE_CACHE_TIMEOUT)
+            cache.set(key, response, timeout)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return None
+        if request.user.is_authenticated:
+            return None
+        name = request.resolver_match.view_name
+        tags = settings.PAGE_CACHE_MODELS.get(name)
+        if tags is None:
+            return None
+        key = tagged_key('page', tags, deployment_version(),
+                         timezone.localdate(), request.path)
+        response = cache.get(key)
+        if response is None:
+            count(name, 'misses')
+            request._page_cache_key = key
+            return None
+        count(name, 'hits')
+        return response
+
+    def is_cacheable(self, request, response):
+        return (response.status_code == 200
+                and not response.streaming
+                and not response.cookies
+                # the page has a csrf token in it, which is per-visitor
+                and not request.META.get('CSRF_COOKIE_USED'))
+
+def count(name, outcome):
+    """ Add one to the hit or miss count of the page named name """
+    key = 'page-cache-%s:%s' % (outcome, name)
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # evicted between add() and incr()
+        cache.set(key, 1, None)
+
+def stats():
+    """ Return dict of each cached page's name to its hits and misses """
+    names = sorted(settings.PAGE_CACHE_MODELS)
+    keys = ['page-cache-%s:%s' % (outcome, name)
+            for name in names for outcome in ('hits', 'misses')]
+    counts = cache.get_many(keys)
+    return { name: {
+                outcome: counts.get('page-cache-%s:%s' % (outcome, name), 0)
+                for outcome in ('hits', 'misses') }
+             for name in names }
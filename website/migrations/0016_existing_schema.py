@@ -0,0 +1,40 @@
+# Generated by Django 2.2.28 on 2026-10-18 09:06
+
+# The models and columns here were added to the production database before
+# they had a migration. Where they already exist, fake this migration alone:
+#   manage.py migrate website 0016_existing_schema --fake
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('website', '0015_event_announcement'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PageContent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=30)),
+                ('content', models.TextField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='bg_desktop',
+            field=models.ImageField(blank=True, null=True, upload_to='webapps/triviatimelive/ttl-website/static/website/images/events/'),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='bg_mobile',
+            field=models.ImageField(blank=True, null=True, upload_to='webapps/triviatimelive/ttl-website/static/website/images/events/'),
+        ),
+        migrations.AddField(
+            model_name='venue',
+            name='logo',
+            field=models.ImageField(blank=True, null=True, upload_to='images/venues/logos/'),
+        ),
+    ]
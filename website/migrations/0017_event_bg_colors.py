@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-18 09:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('website', '0016_existing_schema'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='bg_desktop_color',
+            field=models.CharField(blank=True, default='', editable=False, max_length=20),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='bg_mobile_color',
+            field=models.CharField(blank=True, default='', editable=False, max_length=20),
+        ),
+    ]
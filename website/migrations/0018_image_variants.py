@@ -0,0 +1,28 @@
+# Generated by Django 2.2.28 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('website', '0017_event_bg_colors'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='bg_desktop_variants',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='bg_mobile_variants',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='venue',
+            name='logo_variants',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 2.2.28 on 2026-10-18 09:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('website', '0018_image_variants'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='announcement',
+            name='display_end',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='announcement',
+            index=models.Index(fields=['display_start', 'display_end'], name='website_ann_display_937e92_idx'),
+        ),
+    ]
@@ -1,13 +1,23 @@
 from datetime import date, datetime, timezone, timedelta
+import logging
 import os
+import re
 
 from django.conf       import settings
+from django.contrib.staticfiles.templatetags.staticfiles import static
+from django.core.cache import cache
 from django.db         import models
 from django.utils      import dates, timezone
 from django.utils.text import slugify
 from django.urls       import reverse
+from django.urls.exceptions import NoReverseMatch
+from .                  import snapshot
+from .cache            import deployment_version, invalidate_tags, model_tag
+from .images           import dominant_color, srcset
 from .util             import ordinal
 
+logger = logging.getLogger(__name__)
+
 class Venue(models.Model):
     name             = models.CharField(max_length=200)
     code             = models.CharField(max_length=3)
@@ -22,10 +32,17 @@ class Venue(models.Model):
     logo = models.ImageField(
         upload_to="images/venues/logos/",
         blank=True, null=True)
+    # resized copies of the logo; see images.py
+    logo_variants = models.TextField(blank=True, default='', editable=False)
+    image_variant_widths = {'logo': (160, 320, 480)}
+    updated_at       = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return self.name
 
+    def logo_srcset(self):
+        return srcset(self.logo_variants)
+
     def save(self, get_pennant=False, *args, **kwargs):
         super(Venue, self).save(*args, **kwargs)
         if self.pennant_district:
@@ -75,20 +92,34 @@ class Venue(models.Model):
         pennant.save()
 
     def next_game(self, ignore_hold=False):
-        """ return next occurance of self.day as date object """
+        """ return next occurance of self.day as date object, or None if the
+            venue is on a hold with no end """
         if ignore_hold or not self.active_hold():
             day = date.today()
+        elif self.hold.end is None:
+            return None
         else:
             day = self.hold.end + timedelta(days=1)
         n = (self.day - day.weekday()) % 7
         return day + timedelta(days=n)
 
+    def pennant(self):
+        """ Return the Pennant of this venue's district, or None if it isn't
+            in one, or the district has no pennant """
+        if not self.pennant_district_id:
+            return None
+        try:
+            return self.pennant_district.pennant
+        except Pennant.DoesNotExist:
+            return None
+
     def next_pennant_game(self):
         """ get next game date for pennant """
         # NOTE: (pennant weeks start on a Monday (which is 0)
         today = date.today()
-        if self.has_pennant and self.pennant_district.pennant.next_game >= today:
-            next_game_date = self.pennant_district.pennant.next_game
+        pennant = self.has_pennant and self.pennant()
+        if pennant and pennant.next_game >= today:
+            next_game_date = pennant.next_game
         else:
             days_until_next_monday = (0 - today.weekday()) + 7
             next_game_date = today + timedelta(days_until_next_monday + self.day)
@@ -104,45 +135,68 @@ class Venue(models.Model):
 
     def active_hold(self):
         """ returns boolean of whether the venue has a hold currently in effect.
-            calling this function will also delete an expired hold """
+            expired holds are left alone; they are cleaned up by the
+            sweep_holds management command """
         try:
             hold = self.hold
-            today = date.today()
-            if today >= hold.start and not hold.end:
-                return True
-            elif today >= hold.start and today <= hold.end:
-                return True
-            elif hold.end and today > hold.end:
-                hold.delete()
-                return False
         except Venue.hold.RelatedObjectDoesNotExist:
             return False
-
-class ClueManager(models.Manager):
-    def get_queryset(self):
-        """ Automatically remove any clues over a week old """
-        one_week_ago = date.today() - timedelta(days=7)
-        old = super().get_queryset().filter(date__lt=one_week_ago)
-        for clue in old:
-            clue.delete()
-        return super().get_queryset()
+        return hold.is_active()
 
 class Clue(models.Model):
-    objects = ClueManager()
+    """ The daily clue. Old clues are removed by the prune_clues management
+        command (see settings.CLUE_RETENTION_DAYS) """
     date  = models.DateField(primary_key=True)
     title = models.CharField(max_length=200)
     url   = models.CharField(max_length=200, default='')
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return self.title
 
 class PennantDistrict(models.Model):
     name = models.CharField(max_length=100)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return self.name
 
+class PennantManager(models.Manager):
+    def rollover(self):
+        """ Move the next game of every pennant that's behind its venue's
+            schedule (usually because the game has been played) to the
+            venue's next game, using a single UPDATE.
+            Return the number of pennants that were moved """
+        venues = Venue.objects.filter(
+            has_pennant=True,
+            pennant_district__pennant__isnull=False).select_related(
+            'hold', 'pennant_district__pennant')
+        next_games = {}
+        for venue in venues:
+            # one venue's bad data shouldn't hold up every other pennant
+            try:
+                pennant = venue.pennant_district.pennant
+                venue_next_game = venue.next_game()
+                if venue_next_game is None:
+                    # on hold indefinitely; the pennant waits for it
+                    continue
+                if pennant.next_game < venue_next_game:
+                    next_games[pennant.pk] = venue_next_game
+            except Exception:
+                logger.exception("Couldn't roll over the pennant at %s", venue)
+        if not next_games:
+            return 0
+        moved = self.filter(pk__in=next_games).update(next_game=models.Case(
+            *[models.When(pk=pk, then=models.Value(day))
+              for pk, day in next_games.items()],
+            output_field=models.DateField()))
+        invalidate_tags(model_tag(Pennant))
+        return moved
+
 class Pennant(models.Model):
+    """ The next_game of a pennant is moved forward once a day by the
+        rollover_pennants management command """
+    objects = PennantManager()
     district = models.OneToOneField(
         PennantDistrict,
         primary_key=True,
@@ -161,50 +215,82 @@ class Pennant(models.Model):
             return None
         return venue
 
-    def update_next_game(self):
-        """ if self.next_game is in the past, set it to the next week
-            return self.next_game """
-        today = date.today()
-        venue = self.get_current_venue()
-        if venue:
-            venue_next_game = venue.next_game()
-            if self.next_game < venue_next_game:
-                self.next_game = venue_next_game
-                self.save()
-            return self.next_game
-        else:
-            return None
+def pennant_points(prefix=''):
+    """ Expression for the total pennant points of PennantStandings, or of
+        whatever prefix leads to them (e.g. 'pennantstandings__' for Venues):
+        two for each win or defense, plus one for each place """
+    return (2 * (models.F(prefix + 'win') + models.F(prefix + 'defend'))
+            + models.F(prefix + 'place'))
+
+class PennantStandingsQuerySet(models.QuerySet):
+    def with_total(self):
+        """ Annotate each row with total, computed by the database """
+        return self.annotate(total=pennant_points())
 
 class PennantStandings(models.Model):
     venue  = models.OneToOneField(Venue, on_delete=models.CASCADE)
     win    = models.IntegerField(default=0)
     defend = models.IntegerField(default=0)
     place  = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    objects = PennantStandingsQuerySet.as_manager()
 
     def __str__(self):
         return "%s pennant standings" % self.venue.name
 
     def total_points(self):
+        # standings loaded through PennantStandings.objects.with_total()
+        # already know
+        if hasattr(self, 'total'):
+            return self.total
         return sum([ (2 * sum([self.win, self.defend])), self.place ])
 
+class AnnouncementQuerySet(models.QuerySet):
+    def active(self, now=None):
+        """ Announcements being displayed at now (default: now) """
+        now = now or timezone.now()
+        return self.filter(
+            models.Q(display_end__isnull=True) | models.Q(display_end__gte=now),
+            display_start__lt=now)
+
+    def next_boundary(self, now=None):
+        """ Return the first datetime after now (default: now) at which an
+            announcement starts or stops being displayed, or None """
+        now = now or timezone.now()
+        boundaries = [
+            self.filter(**{field + '__gte': now}).order_by(field).values_list(
+                field, flat=True).first()
+            for field in ('display_start', 'display_end')]
+        boundaries = [b for b in boundaries if b]
+        return min(boundaries) if boundaries else None
+
 class Announcement(models.Model):
     title         = models.CharField(max_length=100)
     description   = models.TextField(max_length=250)
     url           = models.CharField(max_length=250, blank=True, null=True)
     image_url     = models.CharField(max_length=250, blank=True, null=True)
     display_start = models.DateTimeField(default=datetime.now)
-    display_end   = models.DateTimeField(blank=True, null=True)
+    display_end   = models.DateTimeField(blank=True, null=True, db_index=True)
+    updated_at    = models.DateTimeField(auto_now=True, db_index=True)
+
+    objects = AnnouncementQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['display_start', 'display_end']),
+        ]
 
     def __str__(self):
         return self.title
 
     def is_active(self):
         """ BOOL: True if now is between start and end datetimes """
-        now = datetime.now(timezone.utc)
-        if obj.display_end:
-            return obj.display_start < now <= obj.display_end
+        now = timezone.now()
+        if self.display_end:
+            return self.display_start < now <= self.display_end
         else:
-            return obj.display_start < now
+            return self.display_start < now
 
     def is_url_internal(self):
         """ BOOL: True if self.url is linking to an internal page """
@@ -228,6 +314,12 @@ class Hold(models.Model):
     start   = models.DateField(default=timezone.now)
     end     = models.DateField(blank=True, null=True)
     message = models.CharField(max_length=100, blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    def is_active(self, day=None):
+        """ BOOL: True if day (default: today) falls within the hold """
+        day = day or date.today()
+        return self.start <= day and (not self.end or day <= self.end)
 
     def __str__(self):
         start = self.start.strftime("%m/%d/%y"),
@@ -252,6 +344,19 @@ class Event(models.Model):
     bg_mobile    = models.ImageField(
         upload_to="webapps/triviatimelive/ttl-website/static/website/images/events/",
         blank=True, null=True)
+    # most common color of each background, like '(51, 121, 137)'
+    # these are filled in automatically when the images are uploaded
+    bg_desktop_color = models.CharField(max_length=20, blank=True, default='',
+                                        editable=False)
+    bg_mobile_color  = models.CharField(max_length=20, blank=True, default='',
+                                        editable=False)
+    # resized copies of the backgrounds; see images.py
+    bg_desktop_variants = models.TextField(blank=True, default='', editable=False)
+    bg_mobile_variants  = models.TextField(blank=True, default='', editable=False)
+    image_variant_widths = {
+        'bg_desktop': (1280, 1920),
+        'bg_mobile': (480, 960)}
+    updated_at   = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         datestring = "{date} {ord} ({time})".format(
@@ -263,7 +368,31 @@ class Event(models.Model):
             datetime=datestring,
             location=self.location.split('\n')[0].translate('\n'))
 
+    def update_bg_colors(self, force=False):
+        """ Set the *_color fields for any background image that has changed
+            since the event was last saved (or all of them if force) """
+        previous = {}
+        if self.pk and not force:
+            previous = Event.objects.filter(pk=self.pk).values(
+                'bg_desktop', 'bg_mobile').first() or {}
+        for field in ('bg_desktop', 'bg_mobile'):
+            image = getattr(self, field)
+            color_field = field + '_color'
+            if not image:
+                setattr(self, color_field, '')
+            elif (force or image.name != previous.get(field)
+                    or not getattr(self, color_field)):
+                if image._committed:
+                    with image.open('rb'):
+                        setattr(self, color_field, dominant_color(image))
+                else:
+                    # a new upload, which save() still has to store, so
+                    # leave it open
+                    setattr(self, color_field, dominant_color(image))
+
     def save(self, *args, **kwargs):
+        self.update_bg_colors()
+
         # automatically create an Announcement for the event
         # if we're editing this event, instead of creating a new one, we'll
         # create a new announcement (removing the old one) to keep everything
@@ -291,6 +420,84 @@ class Event(models.Model):
         self.announcement = annce
         super(Event, self).save(*args, **kwargs)
 
-class PageContent(models.Model):
+class BasePageContent(models.Model):
+    """ Chunk of CMS-style html shown on a ContentPage.
+        The content may use markup that needs to be resolved before display
+        (see compile()). Compiling happens once, when the content is saved,
+        and the result is cached under a key that changes whenever the urls or
+        static files of the site do, so pages never have to compile it.
+        Content read from the database snapshot is cached apart from the rest,
+        by the snapshot's version, so it's read again once the snapshot is
+        refreshed """
     name = models.CharField(max_length=30)
     content = models.TextField()
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        abstract = True
+
+    def __str__(self):
+        return self.name
+
+    @classmethod
+    def cache_key(cls, name):
+        key = "page-content:%s:%s:%s" % (
+            cls._meta.label_lower, deployment_version(), name)
+        if snapshot.active_version():
+            key += ":snapshot-" + snapshot.active_version()
+        return key
+
+    @staticmethod
+    def cache_timeout():
+        # the snapshot's copies go stale with it, so don't keep them forever
+        return settings.PAGE_CACHE_TIMEOUT if snapshot.active_version() else None
+
+    @classmethod
+    def get_compiled(cls, name):
+        """ Return compiled html of the content called name, or None if there
+            isn't any. Only hits the database if the cache is cold """
+        compiled = cache.get(cls.cache_key(name))
+        if compiled is None:
+            try:
+                compiled = cls.objects.get(name=name).cache_compiled()
+            except cls.DoesNotExist:
+                # remember that there's nothing here too
+                compiled = ''
+                cache.set(cls.cache_key(name), compiled, cls.cache_timeout())
+        return compiled or None
+
+    def cache_compiled(self):
+        """ Compile self.content and store the result in the cache
+            Return the compiled html """
+        compiled = self.compile()
+        cache.set(self.cache_key(self.name), compiled, self.cache_timeout())
+        return compiled
+
+    def uncache(self):
+        cache.delete(self.cache_key(self.name))
+
+    def compile(self):
+        """ Return self.content with its markup resolved """
+        # parse out urls and reverse them
+        # URLs are supplied with the following markup:
+        #    url::website:about_us.html
+        # urls that can't be reversed are prepended with "#bad_url:"
+        url_regex = r'url::([\w\d_:]+)'
+        def url_reverse(match):
+            expanded = match.expand(r'\1')
+            try:
+                return reverse(expanded)
+            except NoReverseMatch:
+                return "#bad_url:" + expanded
+        content_with_urls_reversed = re.sub(
+            url_regex, url_reverse, self.content)
+
+        # parse out static files and reverse (get) them
+        # Static files are supplied with the following markup:
+        #    file::website/images/logos/TTL-stand_up_for_kids_logo.svg
+        static_regex = r'file::([\w\d\-_.:]+)'
+        static_reverse = lambda match: static(match.expand(r'\1'))
+        return re.sub(static_regex, static_reverse, content_with_urls_reversed)
+
+class PageContent(BasePageContent):
+    pass
@@ -0,0 +1,84 @@
+""" Working out which venues have games on which days """
+from collections import defaultdict
+from datetime import timedelta
+
+from .models import Pennant, Venue
+
+def daterange(start, end):
+    """ Yield every date from start to end, inclusive """
+    for n in range((end - start).days + 1):
+        yield start + timedelta(days=n)
+
+class Schedule:
+    """ Every venue's games from start to end (inclusive).
+        Venues, their holds and their pennants are all loaded with a single
+        query up front, so asking about any venue on any day in the range
+        doesn't touch the database again.
+        A venue plays every week on its day (Venue.day), except on days
+        covered by its hold. A venue holding a pennant plays a pennant game
+        on the pennant's next_game (see PennantManager.rollover()) """
+
+    def __init__(self, start, end=None, venues=None):
+        self.start = start
+        self.end = end or start
+        if venues is None:
+            venues = Venue.objects.order_by('time', 'name')
+        self.venues = list(venues.select_related(
+            'hold', 'pennant_district__pennant'))
+        self.by_weekday = defaultdict(list)
+        for venue in self.venues:
+            self.by_weekday[venue.day].append(venue)
+
+    def days(self):
+        return daterange(self.start, self.end)
+
+    def games_on(self, day):
+        """ Return list of the venues with games on day """
+        return [v for v in self.by_weekday[day.weekday()]
+                if not self.is_held(v, day)]
+
+    def games(self):
+        """ Return dict of every day in the schedule to its games """
+        return { day: self.games_on(day) for day in self.days() }
+
+    def pennant_games_on(self, day):
+        """ Return list of the venues with pennant games on day """
+        return [v for v in self.games_on(day) if self.is_pennant_game(v, day)]
+
+    def next_date(self, venue):
+        """ Return the first date in the schedule that falls on venue's day,
+            whether or not it's held """
+        return self.start + timedelta(
+            days=(venue.day - self.start.weekday()) % 7)
+
+    def next_game(self, venue):
+        """ Return the date of venue's first game in the schedule, or None if
+            it's held for all of it """
+        day = self.next_date(venue)
+        while day <= self.end:
+            if not self.is_held(venue, day):
+                return day
+            day += timedelta(days=7)
+        return None
+
+    @staticmethod
+    def hold(venue):
+        try:
+            return venue.hold
+        except Venue.hold.RelatedObjectDoesNotExist:
+            return None
+
+    @classmethod
+    def is_held(cls, venue, day):
+        hold = cls.hold(venue)
+        return hold is not None and hold.is_active(day)
+
+    @staticmethod
+    def is_pennant_game(venue, day):
+        if not venue.has_pennant or not venue.pennant_district:
+            return False
+        try:
+            pennant = venue.pennant_district.pennant
+        except Pennant.DoesNotExist:
+            return False
+        return pennant.next_game == day
@@ -0,0 +1,66 @@
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch           import receiver
+
+from .cache import invalidate_tags, model_tag
+from .images import (load_variants, schedule_variant_deletion,
+                     schedule_variants)
+from .models import BasePageContent
+from .sqlite import set_pragmas
+
+TAGGED_APPS = ('website', 'palooza')
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor == 'sqlite':
+        set_pragmas(connection.connection,
+                    connection.settings_dict.get('PRAGMAS'))
+
+@receiver(post_save)
+@receiver(post_delete)
+def invalidate_model_tag(sender, **kwargs):
+    """ Anything cached that was built from a model is stale once one of its
+        rows changes (see cache.py) """
+    if sender._meta.app_label in TAGGED_APPS:
+        invalidate_tags(model_tag(sender))
+
+# PageContent is compiled when it's saved rather than when it's displayed.
+# These receivers are registered for every model so that they also catch the
+# PageContent models of other apps (palooza); they ignore everything else
+
+@receiver(pre_save)
+def forget_renamed_page_content(sender, instance, raw=False, **kwargs):
+    if issubclass(sender, BasePageContent) and instance.pk and not raw:
+        previous = sender.objects.filter(
+            pk=instance.pk).values_list('name', flat=True).first()
+        if previous and previous != instance.name:
+            sender(name=previous).uncache()
+
+@receiver(post_save)
+def compile_page_content(sender, instance, raw=False, **kwargs):
+    if issubclass(sender, BasePageContent) and not raw:
+        instance.cache_compiled()
+
+@receiver(post_delete)
+def forget_page_content(sender, instance, **kwargs):
+    if issubclass(sender, BasePageContent):
+        # the name may be used by another row, so let the next page view
+        # recompile whatever is left
+        instance.uncache()
+
+@receiver(post_save)
+def build_image_variants(sender, instance, raw=False, **kwargs):
+    """ Make resized copies of newly uploaded images of models that want them """
+    widths = getattr(sender, 'image_variant_widths', None)
+    if not widths or raw:
+        return
+    for field in widths:
+        image = getattr(instance, field)
+        built = load_variants(getattr(instance, field + '_variants'))
+        if (image.name if image else '') != built.get('source', ''):
+            schedule_variants(instance, field)
+
+@receiver(post_delete)
+def delete_image_variants(sender, instance, **kwargs):
+    if getattr(sender, 'image_variant_widths', None):
+        schedule_variant_deletion(instance)
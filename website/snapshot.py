@@ -0,0 +1,90 @@
+""" A read-only copy of the database for public pages
+
+Anonymous requests for the pages in settings.SNAPSHOT_PAGES read from the
+'snapshot' database (see SnapshotMiddleware), so they never wait on, or hold
+up, the check-ins and pennant moves being written to the primary. The
+snapshot is a copy of the primary made with SQLite's online backup API by
+`manage.py refresh_snapshot`, which should be run every few minutes.
+Until there is a snapshot, everything reads from the primary.
+
+Anything cached while reading from the snapshot is keyed by its version (see
+cache.tagged_key()), so it's rebuilt once the snapshot is refreshed """
+import os
+import sqlite3
+import threading
+
+from django.db import DEFAULT_DB_ALIAS, connections
+
+SNAPSHOT_DB_ALIAS = 'snapshot'
+
+_local = threading.local()
+
+def active_version():
+    """ Return the version of the snapshot this thread is reading from, or
+        None if it's reading from the primary """
+    return getattr(_local, 'version', None)
+
+def file_version(path):
+    """ Return a string that changes whenever the file at path is replaced,
+        or None if there's no such file """
+    try:
+        st = os.stat(path)
+    except (OSError, TypeError):
+        return None
+    return '%x-%x' % (st.st_ino, st.st_mtime_ns)
+
+def activate():
+    """ Send this thread's reads to the snapshot, if there is one.
+        Return BOOL: True if there is """
+    if SNAPSHOT_DB_ALIAS not in connections.databases:
+        return False
+    version = file_version(connections.databases[SNAPSHOT_DB_ALIAS]['NAME'])
+    if version is None:
+        return False
+    connection = connections[SNAPSHOT_DB_ALIAS]
+    if getattr(connection, 'snapshot_version', None) != version:
+        # refresh() replaced the file, but this connection still has the old
+        # one open
+        connection.close()
+        connection.snapshot_version = version
+    _local.version = version
+    return True
+
+def deactivate():
+    _local.version = None
+
+def refresh():
+    """ Copy the primary database to the snapshot.
+        The copy is made next to the snapshot and then moved over it, so
+        requests reading the old snapshot carry on undisturbed, and the
+        backup API reads the primary without locking out its writers """
+    primary = connections.databases[DEFAULT_DB_ALIAS]['NAME']
+    path = connections.databases[SNAPSHOT_DB_ALIAS]['NAME']
+    new_path = path + '.new'
+    source = sqlite3.connect(primary)
+    target = sqlite3.connect(new_path)
+    try:
+        source.backup(target)
+        # a WAL database can't be opened by readers that can't write
+        target.execute('PRAGMA journal_mode = DELETE')
+    finally:
+        target.close()
+        source.close()
+    os.replace(new_path, path)
+
+class SnapshotRouter:
+    def db_for_read(self, model, **hints):
+        if active_version() is not None:
+            return SNAPSHOT_DB_ALIAS
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        # even for objects that were read from the snapshot
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        # the snapshot gets its tables from the primary
+        return db != SNAPSHOT_DB_ALIAS
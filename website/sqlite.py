@@ -0,0 +1,12 @@
+""" Tuning for SQLite connections """
+from django.conf import settings
+
+def set_pragmas(connection, pragmas=None):
+    """ Run pragmas (default: settings.SQLITE_PRAGMAS) on a sqlite3
+        connection. journal_mode is stored in the database file, the rest
+        only last as long as the connection.
+        A database in settings.DATABASES can have its own PRAGMAS """
+    if pragmas is None:
+        pragmas = getattr(settings, 'SQLITE_PRAGMAS', {})
+    for name, value in pragmas.items():
+        connection.execute('PRAGMA %s = %s' % (name, value))
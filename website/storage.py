@@ -0,0 +1,63 @@
+""" Where collectstatic puts the site's static files """
+import gzip
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.base import ContentFile
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """ Stores static files under content-hashed names (e.g.
+        style.1d2c3b4a5e6f.css) listed in staticfiles.json, so they can be
+        cached forever, and writes a gzipped (.gz) and, if the brotli package
+        is installed, a brotli (.br) copy next to every file that compresses.
+        Templates get the hashed names through {% static %} """
+
+    # don't break pages over a file that hasn't been collected, just link to
+    # it under its own name
+    manifest_strict = False
+
+    # already compressed, so not worth compressing again
+    skip_extensions = ('.gz', '.br', '.png', '.jpg', '.jpeg', '.gif',
+                       '.webp', '.woff', '.woff2', '.zip')
+    # a compressed copy has to save at least this fraction of the file
+    min_saving = 0.05
+
+    def stored_name(self, name):
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            return name
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        names = set(paths) | set(self.hashed_files.values())
+        for name in sorted(names):
+            for compressed in self.compress(name):
+                yield name, compressed, True
+
+    def compress(self, name):
+        """ Write compressed copies of the file name, and return their names """
+        if name.lower().endswith(self.skip_extensions) or not self.exists(name):
+            return []
+        with self.open(name) as f:
+            content = f.read()
+        encoders = [('.gz', lambda c: gzip.compress(c, 9, mtime=0))]
+        if brotli is not None:
+            encoders.append(('.br', brotli.compress))
+        written = []
+        for extension, encode in encoders:
+            compressed = encode(content)
+            if len(compressed) > len(content) * (1 - self.min_saving):
+                continue
+            compressed_name = name + extension
+            if self.exists(compressed_name):
+                self.delete(compressed_name)
+            self._save(compressed_name, ContentFile(compressed))
+            written.append(compressed_name)
+        return written
@@ -0,0 +1,41 @@
+""" Fixtures shared by the website and palooza tests """
+from datetime import time
+
+from django.contrib.auth.models import User
+
+from .models import Venue
+
+def make_venue(n=None, save=True, **kwargs):
+    """ Return a venue (numbered n, if given, so several can coexist), saved
+        unless save is False. kwargs override any of its fields """
+    fields = {
+        'name': "Venue" if n is None else "Venue %d" % n,
+        'code': "VEN" if n is None else "V%02d" % n,
+        'day': 0 if n is None else n % 7,
+        'time': time(19),
+        'address': "123 Fake St\nPoulsbo, WA",
+    }
+    fields.update(kwargs)
+    venue = Venue(**fields)
+    if save:
+        venue.save()
+    return venue
+
+def make_venues(count, **kwargs):
+    return [make_venue(n, **kwargs) for n in range(count)]
+
+def make_admin(client=None):
+    """ Create a superuser, and log client in as them if given one """
+    user = User.objects.create_superuser(
+        'admin', 'admin@example.com', 'password')
+    if client is not None:
+        client.login(username='admin', password='password')
+    return user
+
+def make_host(client=None):
+    """ Create a host (a user who isn't staff), and log client in as them if
+        given one """
+    user = User.objects.create_user('host', 'host@example.com', 'password')
+    if client is not None:
+        client.login(username='host', password='password')
+    return user
@@ -1,3 +1,447 @@
-from django.test import TestCase
+import copy
+import io
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import uuid
+from datetime import date, timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connections, transaction
+from django.test import (SimpleTestCase, TestCase, TransactionTestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+
+from . import snapshot
+from .cache import invalidate_tags, tagged_key
+from .images import (build_variants, delete_unused_variants, load_variants,
+                     variant_names)
+from .middleware import stats as page_cache_stats
+from .models import (Clue, Event, Hold, PageContent, Pennant, PennantDistrict,
+                     Venue)
+from .snapshot import SnapshotRouter
+from .testing import make_admin, make_venue, make_venues
+from .views import FBPost
+
+class SharedCacheTests(SimpleTestCase):
+    """ Cron commands and every web worker run in their own processes, so
+        invalidating a tag in one has to rebuild what the others cached """
+
+    def setUp(self):
+        # the other process gets settings of its own, so that neither it nor
+        # this one touches the real database or cache
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tmpdir, 'cache')
+        with open(os.path.join(self.tmpdir, 'shared_cache_settings.py'), 'w') as f:
+            f.write(
+                'from triviatimelive.settings import *\n'
+                'DATABASES["default"]["NAME"] = %r\n'
+                'DATABASES["snapshot"]["NAME"] = %r\n'
+                'CACHES["default"]["LOCATION"] = %r\n' % (
+                    os.path.join(self.tmpdir, 'db.sqlite3'),
+                    os.path.join(self.tmpdir, 'db-snapshot.sqlite3'),
+                    self.cache_dir))
+        caches = copy.deepcopy(settings.CACHES)
+        caches['default']['LOCATION'] = self.cache_dir
+        self.override = self.settings(CACHES=caches)
+        self.override.enable()
+
+    def tearDown(self):
+        self.override.disable()
+        shutil.rmtree(self.tmpdir)
+
+    def test_invalidate_from_another_process(self):
+        tag = 'test-%s' % uuid.uuid4().hex
+        key = tagged_key('page', [tag])
+        self.assertEqual(tagged_key('page', [tag]), key)
+
+        subprocess.run(
+            [sys.executable, '-c',
+             'import django; django.setup();'
+             'from website.cache import invalidate_tags;'
+             'invalidate_tags(%r)' % tag],
+            cwd=settings.BASE_DIR, check=True,
+            env=dict(os.environ,
+                     DJANGO_SETTINGS_MODULE='shared_cache_settings',
+                     PYTHONPATH=os.pathsep.join(
+                         [self.tmpdir, settings.BASE_DIR])))
+        self.assertNotEqual(tagged_key('page', [tag]), key)
+        self.assertTrue(os.listdir(self.cache_dir))
+
+class InvalidateOnCommitTests(TransactionTestCase):
+    """ A page rebuilt while a write is still uncommitted would be built from
+        the old rows, so tags are only invalidated once the write commits """
+
+    def test_invalidated_after_commit(self):
+        tag = 'test-%s' % uuid.uuid4().hex
+        key = tagged_key('page', [tag])
+        with transaction.atomic():
+            invalidate_tags(tag)
+            self.assertEqual(tagged_key('page', [tag]), key)
+        self.assertNotEqual(tagged_key('page', [tag]), key)
+
+    def test_not_invalidated_after_rollback(self):
+        tag = 'test-%s' % uuid.uuid4().hex
+        key = tagged_key('page', [tag])
+        try:
+            with transaction.atomic():
+                invalidate_tags(tag)
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertEqual(tagged_key('page', [tag]), key)
+
+class NextPennantGameTests(TestCase):
+
+    def venue(self, **kwargs):
+        return make_venue(save=False, day=2, **kwargs)
+
+    def test_without_district_or_pennant(self):
+        district = PennantDistrict.objects.create(name="North")
+        for venue in [self.venue(),
+                      self.venue(has_pennant=True),
+                      self.venue(has_pennant=True, pennant_district=district)]:
+            next_game = venue.next_pennant_game()
+            self.assertEqual(next_game.weekday(), 2)
+            self.assertGreater(next_game, date.today())
+
+    def test_holder_plays_on_the_pennants_next_game(self):
+        district = PennantDistrict.objects.create(name="North")
+        next_game = date.today() + timedelta(days=10)
+        Pennant.objects.create(district=district, next_game=next_game)
+        venue = self.venue(has_pennant=True, pennant_district=district)
+        self.assertEqual(venue.next_pennant_game(), next_game)
+        venue.has_pennant = False
+        self.assertNotEqual(venue.next_pennant_game(), next_game)
+
+class FBPostTests(TestCase):
+    """ A day's post is built from however many games it happens to have """
+
+    def test_clue_on_a_day_without_games(self):
+        today = date.today()
+        Clue.objects.create(date=today, title="National Earmuff Day")
+        post = FBPost().build_posts(today)[today]
+        self.assertIn("National Earmuff Day", post['string'])
+
+    def test_clue_on_a_day_with_many_games(self):
+        day = date.today() + timedelta(days=1)
+        make_venues(4, day=day.weekday())
+        Clue.objects.create(date=day, title="National Earmuff Day")
+        post = FBPost().build_posts(date.today())[day]
+        self.assertIn("Venue 3", post['string'])
+
+    def test_one_bad_day_leaves_the_rest(self):
+        today = date.today()
+        for n in range(3):
+            Clue.objects.create(date=today + timedelta(days=n), title="Clue")
+        generate_string = FBPost.generate_string
+
+        def fail_tomorrow(view, clue, day, venues):
+            if day == today + timedelta(days=1):
+                raise ValueError
+            return generate_string(view, clue, day, venues)
+
+        with mock.patch.object(FBPost, 'generate_string', fail_tomorrow), \
+                self.assertLogs('website.views', 'ERROR'):
+            posts = FBPost().build_posts(today)
+        self.assertIsNone(posts[today + timedelta(days=1)])
+        self.assertIsNotNone(posts[today])
+        self.assertIsNotNone(posts[today + timedelta(days=2)])
+
+class RolloverTests(TestCase):
+    """ rollover_pennants moves every pennant that's been played for """
+
+    def setUp(self):
+        self.yesterday = date.today() - timedelta(days=1)
+        self.venues = []
+        for n in range(2):
+            district = PennantDistrict.objects.create(name="District %d" % n)
+            Pennant.objects.create(district=district, next_game=self.yesterday)
+            self.venues.append(make_venue(
+                n, pennant_district=district, has_pennant=True))
+        Pennant.objects.update(next_game=self.yesterday)
+
+    def next_games(self):
+        return [v.pennant().next_game for v in Venue.objects.order_by('code')]
+
+    def test_indefinite_hold(self):
+        Hold.objects.create(venue=self.venues[0], start=self.yesterday)
+        self.assertEqual(Pennant.objects.rollover(), 1)
+        self.assertEqual(self.next_games(),
+                         [self.yesterday, self.venues[1].next_game()])
+
+    def test_bad_venue_leaves_the_rest(self):
+        next_game = Venue.next_game
+
+        def fail_first(venue, *args, **kwargs):
+            if venue.pk == self.venues[0].pk:
+                raise ValueError
+            return next_game(venue, *args, **kwargs)
+
+        with mock.patch.object(Venue, 'next_game', fail_first), \
+                self.assertLogs('website.models', 'ERROR'):
+            self.assertEqual(Pennant.objects.rollover(), 1)
+        self.assertEqual(self.next_games(),
+                         [self.yesterday, self.venues[1].next_game()])
+
+@override_settings(CACHES={'default': {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    'LOCATION': 'page-cache-tests'}})
+class PageCacheTests(TransactionTestCase):
+    """ Anonymous visitors get public pages from the cache until something
+        they're built from changes """
+    url = '/triviatimelive/about/us/'
+
+    def setUp(self):
+        cache.clear()
+
+    def counts(self):
+        return page_cache_stats()['website:about']
+
+    def test_hit(self):
+        first = self.client.get(self.url)
+        second = self.client.get(self.url)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(self.counts(), {'hits': 1, 'misses': 1})
+
+    def test_query_string_ignored(self):
+        for n in range(3):
+            self.client.get(self.url, {'fbclid': n})
+        self.assertEqual(self.counts(), {'hits': 2, 'misses': 1})
+
+    def test_logged_in_users_bypass_cache(self):
+        make_admin(self.client)
+        self.client.get(self.url)
+        self.client.get(self.url)
+        self.assertEqual(self.counts(), {'hits': 0, 'misses': 0})
+
+    def test_rebuilt_when_tagged_model_saved(self):
+        self.client.get(self.url)
+        PageContent.objects.create(name="about", content="<p>New!</p>")
+        response = self.client.get(self.url)
+        self.assertContains(response, "New!")
+        self.assertEqual(self.counts(), {'hits': 0, 'misses': 2})
+
+    def test_untagged_model_saved(self):
+        self.client.get(self.url)
+        make_venue()
+        self.client.get(self.url)
+        self.assertEqual(self.counts(), {'hits': 1, 'misses': 1})
+
+class ConditionalPageTests(TestCase):
+    """ Pages that haven't changed since a browser last fetched them are
+        answered with a 304 before their views run """
+    url = '/triviatimelive/venues/'
+
+    def test_not_modified(self):
+        first = self.client.get(self.url)
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(
+            self.url, HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_etag_changes_when_model_saved(self):
+        etag = self.client.get(self.url)['ETag']
+        make_venue()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_etag_differs_by_user(self):
+        etag = self.client.get(self.url)['ETag']
+        make_admin(self.client)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+@override_settings(CACHES={'default': {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    'LOCATION': 'snapshot-tests'}})
+class SnapshotTests(TransactionTestCase):
+    """ Anonymous visitors' public pages are read from the snapshot, and
+        everything else from the primary """
+    databases = {'default', 'snapshot'}
+    url = '/triviatimelive/venues/'
+
+    def setUp(self):
+        cache.clear()
+        # in tests the snapshot is the test database under another name, so
+        # just pretend there's a snapshot file
+        patcher = mock.patch.object(snapshot, 'file_version', return_value='v1')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(snapshot.deactivate)
+
+    def queries(self, method, url):
+        """ Return the number of queries a request makes on each database """
+        with CaptureQueriesContext(connections['default']) as default, \
+                CaptureQueriesContext(connections['snapshot']) as snap:
+            getattr(self.client, method)(url)
+        return len(default), len(snap)
+
+    def test_anonymous_get(self):
+        default, snap = self.queries('get', self.url)
+        self.assertEqual(default, 0)
+        self.assertGreater(snap, 0)
+
+    def test_logged_in(self):
+        make_admin(self.client)
+        default, snap = self.queries('get', self.url)
+        self.assertGreater(default, 0)
+        self.assertEqual(snap, 0)
+
+    def test_post(self):
+        default, snap = self.queries('post', '/triviatimelive/contact/hire-us/')
+        self.assertEqual(snap, 0)
+
+    def test_other_pages(self):
+        default, snap = self.queries('get', '/triviatimelive/pennant/about/')
+        self.assertEqual(snap, 0)
+
+    def test_writes_go_to_primary(self):
+        snapshot.activate()
+        self.assertEqual(SnapshotRouter().db_for_read(Venue), 'snapshot')
+        self.assertEqual(SnapshotRouter().db_for_write(Venue), 'default')
+
+    def test_page_content_cached_by_snapshot(self):
+        PageContent.objects.create(name="about", content="old")
+        PageContent.objects.update(content="new")
+        snapshot.activate()
+        self.assertEqual(PageContent.get_compiled("about"), "new")
+        PageContent.objects.update(content="newer")
+        self.assertEqual(PageContent.get_compiled("about"), "new")
+        # refreshed
+        snapshot.file_version.return_value = 'v2'
+        snapshot.activate()
+        self.assertEqual(PageContent.get_compiled("about"), "newer")
+        snapshot.deactivate()
+        # the primary's copy isn't touched by any of that
+        self.assertEqual(PageContent.get_compiled("about"), "old")
+
+class RefreshSnapshotTests(SimpleTestCase):
+
+    def setUp(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        self.primary = os.path.join(tmpdir, 'db.sqlite3')
+        self.snapshot = os.path.join(tmpdir, 'db-snapshot.sqlite3')
+        patcher = mock.patch.dict(connections.databases, {
+            'default': dict(connections.databases['default'], NAME=self.primary),
+            'snapshot': dict(connections.databases['snapshot'], NAME=self.snapshot)})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def execute(self, path, sql):
+        db = sqlite3.connect(path)
+        try:
+            with db:
+                return db.execute(sql).fetchall()
+        finally:
+            db.close()
+
+    def test_refresh(self):
+        self.execute(self.primary, "PRAGMA journal_mode = WAL")
+        self.execute(self.primary, "CREATE TABLE clue (title TEXT)")
+        self.execute(self.primary, "INSERT INTO clue VALUES ('first')")
+        call_command('refresh_snapshot')
+        version = snapshot.file_version(self.snapshot)
+        self.assertEqual(self.execute(self.snapshot, "SELECT * FROM clue"),
+                         [('first',)])
+        self.assertEqual(self.execute(self.snapshot, "PRAGMA journal_mode"),
+                         [('delete',)])
+
+        self.execute(self.primary, "INSERT INTO clue VALUES ('second')")
+        call_command('refresh_snapshot')
+        self.assertEqual(len(self.execute(self.snapshot, "SELECT * FROM clue")), 2)
+        self.assertNotEqual(snapshot.file_version(self.snapshot), version)
+
+class ImageVariantTests(TestCase):
+    """ Uploaded images get resized copies, which are deleted once nothing
+        uses them """
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        override = self.settings(MEDIA_ROOT=media)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def image(self, color, size=(600, 300), name='logo.png'):
+        buf = io.BytesIO()
+        Image.new('RGB', size, color).save(buf, 'PNG')
+        return SimpleUploadedFile(name, buf.getvalue(), 'image/png')
+
+    def build(self, venue):
+        # normally done in the background once the upload is committed
+        build_variants('website.Venue', venue.pk, 'logo')
+        venue.refresh_from_db()
+        return load_variants(venue.logo_variants)
+
+    def assertStored(self, names, stored=True):
+        for name in names:
+            self.assertEqual(default_storage.exists(name), stored, name)
+
+    def test_variants(self):
+        venue = make_venue(logo=self.image('red'))
+        variants = self.build(venue)
+        self.assertEqual(variants['source'], venue.logo.name)
+        self.assertEqual([w for w, _ in variants['fallback']], [160, 320, 480])
+        self.assertTrue(all(name.endswith('.jpg')
+                            for _, name in variants['fallback']))
+        self.assertStored(variant_names(variants))
+        self.assertTrue(venue.logo_srcset()['fallback'])
+
+    def test_never_enlarged(self):
+        variants = self.build(make_venue(logo=self.image('red', (200, 100))))
+        self.assertEqual([w for w, _ in variants['fallback']], [160, 200])
+
+    def test_replaced_variants_deleted(self):
+        venue = make_venue(logo=self.image('red'))
+        old = variant_names(self.build(venue))
+        venue.logo = self.image('blue')
+        venue.save()
+        new = variant_names(self.build(venue))
+        self.assertFalse(old & new)
+        self.assertStored(old, False)
+        self.assertStored(new)
+
+    def test_shared_variants_kept(self):
+        venues = [make_venue(n, logo=self.image('red')) for n in range(2)]
+        shared = variant_names(self.build(venues[0]))
+        self.assertEqual(variant_names(self.build(venues[1])), shared)
+        venues[0].logo = None
+        venues[0].save()
+        self.assertEqual(self.build(venues[0]), {})
+        self.assertStored(shared)
+
+    def test_deleted_object_variants(self):
+        venue = make_venue(logo=self.image('red'))
+        names = variant_names(self.build(venue))
+        venue.delete()
+        # normally done in the background once the delete is committed
+        delete_unused_variants(names)
+        self.assertStored(names, False)
+
+    def test_background_color_file_closed(self):
+        Event(title="Party", time=timezone.now(), location="Here",
+              description="Fun",
+              bg_desktop=self.image('red', name='bg.png')).save()
+        event = Event.objects.get()
+        self.assertEqual(event.bg_desktop_color, '(255, 0, 0)')
+        event.update_bg_colors(force=True)
+        self.assertEqual(event.bg_desktop_color, '(255, 0, 0)')
+        self.assertTrue(event.bg_desktop.closed)
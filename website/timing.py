@@ -0,0 +1,135 @@
+""" Where each request's time goes
+
+RequestStatsMiddleware (see middleware.py) times every request and counts
+its queries, and this module keeps the last settings.REQUEST_STATS_SAMPLES
+measurements of each view so that summary() can show which views are slow.
+Templates are timed by TimedDjangoTemplates, which settings.TEMPLATES uses
+in place of Django's own backend.
+
+The measurements are kept in memory, so each server process has its own """
+from collections import deque
+import threading
+import time
+
+from django.conf import settings
+from django.template.backends.django import DjangoTemplates
+
+_local = threading.local()
+_lock = threading.Lock()
+_samples = {}
+
+# in the order the summary shows them
+FIELDS = ('total', 'queries', 'sql', 'render', 'size')
+PERCENTILES = (50, 95, 99)
+
+class RequestTiming:
+    """ The measurements of one request, in milliseconds and bytes """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.total = None
+        self.queries = 0
+        self.sql = 0.0
+        self.render = 0.0
+        self.size = None
+
+    def execute(self, execute, sql, params, many, context):
+        """ Database execute wrapper that counts and times the query """
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.sql += (time.perf_counter() - started) * 1000
+
+    def finish(self, response):
+        self.total = (time.perf_counter() - self.started) * 1000
+        if not response.streaming:
+            self.size = len(response.content)
+        elif response.has_header('Content-Length'):
+            self.size = int(response['Content-Length'])
+
+    def as_header(self):
+        return '; '.join([
+            'queries=%d' % self.queries,
+            'sql=%.1fms' % self.sql,
+            'render=%.1fms' % self.render,
+            'total=%.1fms' % self.total,
+            'size=%s' % ('-' if self.size is None else self.size)])
+
+def start():
+    """ Start timing this thread's request, and return its RequestTiming """
+    _local.timing = RequestTiming()
+    return _local.timing
+
+def stop():
+    _local.timing = None
+
+def current():
+    """ Return the RequestTiming of this thread's request, or None """
+    return getattr(_local, 'timing', None)
+
+def record(name, timing):
+    """ Keep timing as the latest measurement of the view named name """
+    with _lock:
+        samples = _samples.get(name)
+        if samples is None:
+            samples = _samples[name] = deque(
+                maxlen=settings.REQUEST_STATS_SAMPLES)
+        samples.append(timing)
+
+def percentile(values, p):
+    """ Return the p-th percentile of the sorted list values (nearest rank) """
+    if not values:
+        return None
+    rank = -(-len(values) * p // 100)
+    return values[max(rank, 1) - 1]
+
+def summary():
+    """ Return list of (name, requests, [(field, [percentiles])]) for every
+        view that's been measured, slowest (by p95 of total) first.
+        Fields and percentiles are in the order of FIELDS and PERCENTILES """
+    with _lock:
+        samples = { name: list(timings) for name, timings in _samples.items() }
+    views = []
+    for name, timings in samples.items():
+        stats = []
+        for field in FIELDS:
+            values = sorted(getattr(t, field) for t in timings
+                            if getattr(t, field) is not None)
+            stats.append((field, [percentile(values, p) for p in PERCENTILES]))
+        views.append((name, len(timings), stats))
+    p95 = PERCENTILES.index(95)
+    views.sort(key=lambda view: -(dict(view[2])['total'][p95] or 0))
+    return views
+
+class TimedTemplate:
+    """ Wraps a backend template, adding the time it takes to render to
+        the current request's """
+
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        timing = current()
+        if timing is None:
+            return self.template.render(context, request)
+        started = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            timing.render += (time.perf_counter() - started) * 1000
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """ Django's template backend, with every template timed (see
+        TimedTemplate). Templates included by other templates count towards
+        the one including them """
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
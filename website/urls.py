@@ -11,6 +11,7 @@ urlpatterns = [
     path('contact/hire-us/', views.HireUs.as_view(), name='hire_us'),
     path('contact/questions/', views.ContactQuestions.as_view(), name='contact_questions'),
     path('events/<int:id>/<slug:slug>/', views.EventView.as_view(), name='event'),
+    path('fbpost/week/', views.FBPostWeek.as_view(), name='fbpost_week'),
     path('fbpost/<day>/', views.FBPost.as_view(), name='fbpost'),
     path('fbpost/<day>/raw/', views.FBPost.as_view(), {'raw': True}, name='fbpost_raw'),
     path('fbpost/<day>/url/', views.FBPost.as_view(), {'url': True}, name='fbpost_url'),
@@ -20,5 +21,7 @@ urlpatterns = [
     path('pennant/move/', views.MovePennant.as_view(), name='move_pennant'),
     path('pennant/standings/', views.PennantStandings.as_view(), name='pennant_standings'),
     path('pennant/standings/update/', views.UpdatePennantStandings.as_view(), name='update_standings'),
+    path('stats/page-cache/', views.PageCacheStats.as_view(), name='page_cache_stats'),
+    path('stats/requests/', views.RequestStats.as_view(), name='request_stats'),
     path('venues/', views.Venues.as_view(), name='venues'),
 ]
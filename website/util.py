@@ -1,5 +1,19 @@
+from datetime import datetime, timedelta
 import math
 
+from django.utils import timezone
+
 # Function to turn 1 into '1st', 2 into '2nd', 3 into '3rd, etc
 # source: https://stackoverflow.com/questions/9647202/ordinal-numbers-replacement#20007730
 ordinal = lambda n: "%d%s" % (n,"tsnrhtdd"[(math.floor(n/10)%10!=1)*(n%10<4)*n%10::4])
+
+def seconds_until(moment):
+    """ Return whole number of seconds from now until the aware datetime
+        moment, rounded up so that a cache timeout never ends early """
+    return max(math.ceil((moment - timezone.now()).total_seconds()), 1)
+
+def end_of_day(day):
+    """ Return aware datetime of the midnight that ends day, in the current
+        time zone """
+    return timezone.make_aware(
+        datetime.combine(day + timedelta(days=1), datetime.min.time()))
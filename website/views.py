@@ -1,81 +1,135 @@
 from datetime  import date, datetime, timezone, timedelta
-from PIL import Image
+import logging
 from random    import choice
 import re
 
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.staticfiles import finders
-from django.contrib.staticfiles.templatetags.staticfiles import static
+from django.core.cache import cache
 from django.shortcuts import render, redirect
-from django.http      import HttpResponse, HttpResponseRedirect, Http404
+from django.http      import (HttpResponse, HttpResponseRedirect, Http404,
+                              JsonResponse)
 from django.urls      import reverse
-from django.urls.exceptions import NoReverseMatch
-from django.utils     import dates
+from django.utils     import dates, timezone
 from django.utils.text import slugify
 from django.views     import generic, View
 
-from .models          import (Announcement, Clue, Event, Pennant,
+from .cache           import cached_until, model_tag, tagged_key
+from .models          import (Announcement, Clue, Event, Hold, Pennant,
                               PageContent, PennantDistrict, PennantStandings,
-                              Venue)
+                              Venue, pennant_points)
 from .forms           import BusinessHireUsForm, EventHireUsForm, LoginForm
-from .util            import ordinal
+from .images          import image_set
+from .middleware      import stats as page_cache_stats
+from .schedule        import Schedule
+from .timing          import (FIELDS, PERCENTILES,
+                              summary as request_stats)
+from .util            import end_of_day, ordinal
+from .writer          import submit
 
 LOGIN_URL = '/triviatimelive/login/'
 
+logger = logging.getLogger(__name__)
+
 class Index(View):
     template_name = "website/index.html"
 
     def get(self, request):
-        context = self.get_context()
-        return render(request, self.template_name, context)
+        context, expires = self.get_context()
+        response = render(request, self.template_name, context)
+        # for the page cache (see middleware.py)
+        response.cache_until = expires
+        return response
 
     def get_context(self):
-        """ Return dict of today's games, clue, and announcements """
-        today = date.today()
-        # the Venue days are zero-indexed, but isoweekday is one-indexed,
-        # hence the '-1'
-        games = Venue.objects.filter(
-            day=today.isoweekday()-1).order_by('time', 'name')
-        games = list(filter(lambda v: not v.active_hold(), games))
-        announcements = Announcement.objects.all().order_by('-display_start')
-        active_announcements = list(filter(self.is_announcement_active, announcements))
+        """ Return dict of today's games, clue, and announcements, and the
+            datetime after which it's stale.
+            This is built once and cached until midnight, the next time an
+            announcement starts or stops being displayed, or one of the
+            models it's built from changes, whichever comes first """
+        today = timezone.localdate()
+        key = tagged_key('index', self.snapshot_tags, today)
+        return cached_until(key, lambda: self.build_context(today))
+
+    snapshot_tags = [model_tag(m) for m in (
+        Announcement, Clue, Event, Hold, Pennant, PennantDistrict, Venue)]
+
+    def build_context(self, today):
+        """ Return today's context and the datetime after which it's stale """
+        expires = end_of_day(today)
+        # the schedule loads everything the template touches, so the cached
+        # venues don't need to go back to the database
+        games = Schedule(today).games_on(today)
+        announcements, changes = self.get_announcements()
+        if changes and changes < expires:
+            expires = changes
         try:
             clue = Clue.objects.get(date=today)
         except Clue.DoesNotExist:
             clue = {'title': 'Coming Soon!', 'url': ''}
-        return {
+        context = {
             'todays_games': games,
             'todays_clue': clue,
-            'announcements': self.make_pennant_announcements() + active_announcements,
+            'announcements': self.make_pennant_announcements(today) + announcements,
         }
+        return (context, expires), expires
+
+    def get_announcements(self):
+        """ Return list of the announcements being displayed now, and the
+            datetime that list next changes (None if it never will).
+            Cached until then """
+        key = tagged_key('announcements', [model_tag(Announcement)])
+        return cached_until(key, self.build_announcements)
+
+    def build_announcements(self):
+        now = timezone.now()
+        announcements = list(
+            Announcement.objects.active(now).order_by('-display_start'))
+        changes = Announcement.objects.next_boundary(now)
+        return (announcements, changes), changes
+
+    def make_pennant_announcements(self, today=None):
+        """ Return list of announcements (dicts) of each pennant's next game
+            These are cached until a pennant (or its venue) moves """
+        today = today or date.today()
+        key = tagged_key('pennant-announcements', self.pennant_tags, today)
+        announcements = cache.get(key)
+        if announcements is None:
+            announcements = self.build_pennant_announcements(today)
+            cache.set(key, announcements, 24 * 60 * 60)
+        return announcements
 
-    def is_announcement_active(self, ann):
-        """ BOOL: True if now is between ann.display_start and ann.display_end datetimes """
-        now = datetime.now(timezone.utc)
-        if ann.display_end:
-            return ann.display_start < now <= ann.display_end
-        else:
-            return ann.display_start < now
+    pennant_tags = [model_tag(m) for m in (Hold, Pennant, PennantDistrict, Venue)]
 
-    def make_pennant_announcements(self):
-        pennant_districts = PennantDistrict.objects.all()
+    def build_pennant_announcements(self, today):
+        """ Load every district's pennant and the venue that holds it with a
+            single query and describe their next games """
+        venues = Venue.objects.filter(
+            has_pennant=True,
+            pennant_district__pennant__isnull=False).select_related(
+            'pennant_district__pennant', 'hold').order_by(
+            'pennant_district', 'name')
         announcements = []
-        for district in pennant_districts:
-            pennant = Pennant.objects.get(district=district)
-            venue = pennant.get_current_venue()
-
-            if not venue:
-                break
-
-            game = pennant.update_next_game()
-            preposition = 'in' if 'Bainbridge' not in venue.city() else 'on'
-            if game == date.today():
+        districts = set()
+        for venue in venues:
+            # there should only be one venue per pennant, but just in case
+            if venue.pennant_district_id in districts:
+                continue
+            districts.add(venue.pennant_district_id)
+            pennant = venue.pennant_district.pennant
+            city = venue.city()
+
+            # kept up to date by the rollover_pennants command
+            game = pennant.next_game
+            preposition = 'in' if 'Bainbridge' not in city else 'on'
+            if game == today:
                 day = "Tonight"
             else:
                 day = game.strftime('%A, %B ') + ordinal(game.day)
-            if venue.city().lower() in venue.name.lower():
+            if city.lower() in venue.name.lower():
                 description = '{day} at {venue} at {time}'.format(
                     day=day,
                     venue=venue.name,
@@ -85,7 +139,7 @@ class Index(View):
                     day=day,
                     venue=venue.name,
                     prep=preposition,
-                    city=venue.city(),
+                    city=city,
                     time=venue.time.strftime('%l:%M%P'))
             announcement = {
                     'title': 'Next %s Game' % pennant,
@@ -111,34 +165,7 @@ class ContentPage(View):
             template = self.extra_context.get('template', '')
             if template:
                 name = template.split('/')[-1].split('.')[0]
-                try:
-                    static_content = self.content_model.objects.get(name=name)
-                except self.content_model.DoesNotExist:
-                    return None
-
-                # parse out urls and reverse them
-                # URLs are supplied with the following markup:
-                #    url::website:about_us.html
-                # urls that can't be reversed are prepended with "#bad_url:"
-                url_regex = r'url::([\w\d_:]+)'
-                def url_reverse(match):
-                    expanded = match.expand(r'\1')
-                    try:
-                        return reverse(expanded)
-                    except NoReverseMatch:
-                        return "#bad_url:" + expanded
-                content_with_urls_reversed = re.sub(
-                    url_regex, url_reverse, static_content.content)
-
-                # parse out static files and reverse (get) them
-                # Static files are supplied with the following markup:
-                #    file::website/images/logos/TTL-stand_up_for_kids_logo.svg
-                static_regex = r'file::([\w\d\-_.:]+)'
-                static_reverse = lambda match: static(match.expand(r'\1'))
-                content_with_static_files_reversed = re.sub(
-                    static_regex, static_reverse, content_with_urls_reversed)
-
-                return content_with_static_files_reversed
+                return self.content_model.get_compiled(name)
         return None
 
 class About(ContentPage, generic.TemplateView):
@@ -193,14 +220,14 @@ class Venues(ContentPage, generic.ListView):
              "content": "noindex, nofollow"}]}
 
     def get_queryset(self):
-        """ Return all venues ordered by their days and then names """
-        def set_extra_venue_fields(venue):
-            """ set next_date and logo_url properties """
-            venue.next_date = venue.next_game(ignore_hold=True)
-            return venue
-
-        return [set_extra_venue_fields(v)
-                for v in Venue.objects.order_by("day", "name")]
+        """ Return all venues ordered by their days and then names, with
+            the date of their next game (held or not) as next_date """
+        today = date.today()
+        schedule = Schedule(today, today + timedelta(days=6),
+                            venues=Venue.objects.order_by("day", "name"))
+        for venue in schedule.venues:
+            venue.next_date = schedule.next_date(venue)
+        return schedule.venues
 
 class PennantAbout(ContentPage, generic.TemplateView):
     extra_context = {
@@ -214,12 +241,12 @@ class PennantStandings(ContentPage, generic.ListView):
         "template": "website/pennant_standings.html"}
 
     def get_queryset(self):
-        """ Return all active venues """
-        venues = Venue.objects.exclude(pennant_district=None)
-        return list(sorted(venues,
-            key=lambda v: (v.pennant_district.name,
-                           -v.pennantstandings.total_points(),
-                           v.name)))
+        """ Return all active venues, with their standings, sorted by
+            district and points """
+        return Venue.objects.exclude(pennant_district=None).select_related(
+            'pennant_district', 'pennantstandings').annotate(
+            total=pennant_points('pennantstandings__')).order_by(
+            'pennant_district__name', '-total', 'name')
 
 class EventView(ContentPage, View):
     model = Event
@@ -244,35 +271,17 @@ class EventView(ContentPage, View):
             "header": header,
             "bg_desktop_url": bg_desktop_url,
             "bg_mobile_url": bg_mobile_url,
+            # computed when the images were uploaded (see Event.save)
+            "bg_desktop_color": event.bg_desktop_color or None,
+            "bg_mobile_color": event.bg_mobile_color or None,
+            # resized copies, for browsers that understand image-set()
+            "bg_desktop_set": image_set(event.bg_desktop_variants, 1920),
+            "bg_mobile_set": image_set(event.bg_mobile_variants, 960),
             "content": event}
 
-        bg_color_info = self.get_bg_color_info(event)
-
-        context.update(bg_color_info)
         context.update(self.extra_context)
         return render(request, self.template_name, context)
 
-    def color_distance(a, b):
-        """ Return the distance (closeness) of two colors """
-        return sqrt(abs((a[0] - b[0])^2 + (a[1] - b[1])^2 + (a[2] - b[2])^2))
-
-    def most_common_color(self, im_url):
-        """ Find the most common color in an image """
-        im = Image.open(im_url).resize((75, 75), Image.ANTIALIAS)
-        colors = im.getcolors(im.size[0] * im.size[1])
-        most_common = list(reversed(sorted(colors, key=lambda x: x[0])))[0]
-        return str(most_common[1])
-
-    def get_bg_color_info(self, event):
-        """ Return dict of most-common colors desktop and mobile backgrounds """
-        bg_desktop_color, bg_mobile_color = (None, None)
-        if event.bg_desktop:
-            bg_desktop_color = self.most_common_color(event.bg_desktop.url)
-        if event.bg_mobile:
-            bg_mobile_color = self.most_common_color(event.bg_mobile.url)
-        return { "bg_desktop_color": bg_desktop_color,
-                 "bg_mobile_color": bg_mobile_color }
-
 class Login(ContentPage, generic.TemplateView):
     extra_context = {
         'header': "Login",
@@ -355,10 +364,13 @@ class MovePennant(LoginRequiredMixin, View):
         next_game = date(2000 + year, month, day)
         print(next_game)
 
-        venue.get_pennant()
-        if pennant.next_game != next_game:
-            pennant.next_game = next_game
-            pennant.save()
+        def move():
+            venue.get_pennant()
+            pennant.refresh_from_db()
+            if pennant.next_game != next_game:
+                pennant.next_game = next_game
+                pennant.save()
+        submit(move)
 
         context = self.get_context()
         context['success'] = True
@@ -376,7 +388,8 @@ class UpdatePennantStandings(LoginRequiredMixin, ContentPage, generic.TemplateVi
     def get_context(self):
         """ All this view really needs is a list of venues """
         venues = Venue.objects.exclude(
-                pennant_district=None).order_by('name')
+                pennant_district=None).select_related(
+                'pennantstandings').order_by('name')
         return {'venues': venues}
 
     def post(self, request):
@@ -407,7 +420,7 @@ class UpdatePennantStandings(LoginRequiredMixin, ContentPage, generic.TemplateVi
         venue.pennantstandings.win = win
         venue.pennantstandings.defend = defend
         venue.pennantstandings.place = place
-        venue.pennantstandings.save()
+        submit(venue.pennantstandings.save)
 
         context = self.get_context()
         context['success'] = True
@@ -438,16 +451,12 @@ class FBPost(LoginRequiredMixin, View):
 
         day = self.next_occurance_of_day(day)
 
-        try:
-            clue   = Clue.objects.get(date=day)
-        except Clue.DoesNotExist:
+        post = self.get_posts()[day]
+        if post is None:
             return render(request, self.template_name, {
                 'clue': {'date': date.today(), 'title': "No Clue Yet"},
                 'string': "We don't have a clue for this day yet."})
-        venues = list(filter(
-            lambda x: not x.active_hold() or day > x.hold.end,
-            Venue.objects.filter(day=day.weekday()).order_by("time", "name")))
-        string = self.generate_string(clue, day, venues)
+        clue, string = post['clue'], post['string']
         if raw:
             return HttpResponse(string)
         elif url:
@@ -462,6 +471,42 @@ class FBPost(LoginRequiredMixin, View):
                 'clue': clue,
                 'string': string})
 
+    post_tags = [model_tag(m) for m in (
+        Clue, Hold, Pennant, PennantDistrict, Venue)]
+
+    def get_posts(self):
+        """ Return dict of each of the next seven days (starting today) to its
+            post: a dict of its clue and string, or None if it doesn't have a
+            clue yet (or its post couldn't be built, which is logged).
+            All seven are built together and cached until midnight, or until
+            a clue, venue, hold or pennant changes, so that the post for a day
+            reads the same every time it's asked for """
+        today = date.today()
+        key = tagged_key('fbposts', self.post_tags, today)
+        return cached_until(
+            key, lambda: (self.build_posts(today), end_of_day(today)))
+
+    def build_posts(self, today):
+        end = today + timedelta(days=6)
+        schedule = Schedule(today, end)
+        clues = { c.date: c for c in Clue.objects.filter(
+            date__range=(today, end)) }
+        posts = {}
+        for day in schedule.days():
+            clue = clues.get(day)
+            if clue is None:
+                posts[day] = None
+                continue
+            # one day's odd schedule shouldn't take the rest of the week down
+            try:
+                string = self.generate_string(clue, day, schedule.games_on(day))
+            except Exception:
+                logger.exception("Couldn't build the FB post for %s", day)
+                posts[day] = None
+            else:
+                posts[day] = {'clue': clue, 'string': string}
+        return posts
+
     def generate_string(self, clue, day, venues):
         string = ""
         pennant_venues = self.pennant_games(day, venues)
@@ -812,7 +857,7 @@ class FBPost(LoginRequiredMixin, View):
         if ispennant:
             return choice(pennant)
         else:
-            return choice(by_day.get(day.weekday()) + by_num.get(len(venues)) + general)
+            return choice(by_day[day.weekday()] + by_num.get(len(venues), []) + general)
 
     def next_occurance_of_day(self, weekday):
         """ Takes int [0-6] (monday==0) and returns date object of that day's
@@ -824,9 +869,33 @@ class FBPost(LoginRequiredMixin, View):
 
     def pennant_games(self, day, venues):
         """ return list of venues that have pennant games on day (can be empty) """
-        has_pennant = list(filter(lambda x: x.has_pennant, venues))
-        pennants_today = []
-        if has_pennant:
-            pennants_today = [ v for v in has_pennant if
-                v.pennant_district.pennant.next_game == day ]
-        return pennants_today
+        return [ v for v in venues if Schedule.is_pennant_game(v, day) ]
+
+class FBPostWeek(FBPost):
+    """ Shows the FB posts for the next seven days """
+    template_name = "website/fbpost_week.html"
+
+    def get(self, request):
+        return render(request, self.template_name, {
+            'posts': sorted(self.get_posts().items())})
+
+class PageCacheStats(LoginRequiredMixin, View):
+    """ Returns the page cache's hits and misses for each page as JSON """
+    login_url = LOGIN_URL
+    redirect_field_name = "redirect_to"
+
+    def get(self, request):
+        return JsonResponse(page_cache_stats())
+
+class RequestStats(LoginRequiredMixin, View):
+    """ Shows how long each view's recent requests took, slowest first """
+    template_name = "website/request_stats.html"
+    login_url = LOGIN_URL
+    redirect_field_name = "redirect_to"
+
+    def get(self, request):
+        return render(request, self.template_name, {
+            'views': request_stats(),
+            'fields': FIELDS,
+            'percentiles': PERCENTILES,
+            'samples': settings.REQUEST_STATS_SAMPLES})
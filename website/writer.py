@@ -0,0 +1,130 @@
+""" One thread that does all of the site's writes
+
+SQLite lets only one connection write at a time, and on a busy night every
+host's check-ins, standings updates and pennant moves arrive at once. Rather
+than have each request take the write lock for itself (and the rest wait on
+busy_timeout, or give up with "database is locked"), requests hand their
+writes to the writer thread with submit(), which waits for the result.
+
+The writer runs whatever has queued up since its last commit in one shared
+transaction, each operation in its own savepoint: an operation that raises
+is rolled back on its own and its exception re-raised in the request that
+submitted it, while the others are committed together. Results are only
+handed back once they've been committed.
+
+The writer only serializes the writes of its own process. Management
+commands have a writer of their own, so a batch can still find another
+process holding the write lock; it's then tried again from the start (see
+is_locked()). The check-ins, pennant moves, image variants and the
+management commands' writes go through the writer. Admin saves and Django's
+own session and last_login writes don't: they're rare, and wait on
+settings.SQLITE_PRAGMAS' busy_timeout instead """
+from concurrent.futures import Future
+import queue
+import threading
+import time
+
+from django.db import (OperationalError, close_old_connections, connection,
+                       transaction)
+
+def is_locked(error):
+    """ BOOL: True if error is SQLite giving up on the write lock, which
+        another process is holding """
+    return (isinstance(error, OperationalError)
+            and 'database is locked' in str(error))
+
+class Writer:
+    def __init__(self, max_batch=100, retries=3, retry_delay=0.1):
+        # most operations to commit in one transaction
+        self.max_batch = max_batch
+        # times to try a batch again if the database is locked, waiting
+        # retry_delay seconds longer each time
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.queue = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+        # how many transactions and operations have been committed, for
+        # benchmarks and tests
+        self.batches = 0
+        self.operations = 0
+
+    def submit(self, operation, *args, **kwargs):
+        """ Run operation(*args, **kwargs) on the writer thread, and return
+            its result (or raise its exception) once it's committed """
+        if (threading.current_thread() is self.thread
+                or connection.in_atomic_block):
+            # already on the writer, or inside a transaction the operation
+            # has to be part of
+            return operation(*args, **kwargs)
+        future = Future()
+        self.queue.put((future, operation, args, kwargs))
+        self.start()
+        return future.result()
+
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(
+                    target=self.run, name='writer', daemon=True)
+                self.thread.start()
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            self.write(batch)
+
+    def write(self, batch):
+        """ Run and commit a batch of queued operations, and hand back their
+            results """
+        try:
+            for attempt in range(self.retries + 1):
+                try:
+                    outcomes = self.run_batch(batch)
+                except Exception as e:
+                    if is_locked(e) and attempt < self.retries:
+                        time.sleep(self.retry_delay * (attempt + 1))
+                        continue
+                    # the commit failed, so none of it was written
+                    for future, _, _, _ in batch:
+                        future.set_exception(e)
+                else:
+                    self.batches += 1
+                    self.operations += len(batch)
+                    for future, result, error in outcomes:
+                        if error is None:
+                            future.set_result(result)
+                        else:
+                            future.set_exception(error)
+                break
+        finally:
+            # the writer isn't a request, so nothing else will close its
+            # connection once it's broken or past CONN_MAX_AGE
+            close_old_connections()
+
+    def run_batch(self, batch):
+        """ Run a batch in one transaction, and return list of the
+            (future, result, exception) of each of its operations """
+        outcomes = []
+        with transaction.atomic():
+            for future, operation, args, kwargs in batch:
+                try:
+                    with transaction.atomic():
+                        outcomes.append((future, operation(*args, **kwargs), None))
+                except Exception as e:
+                    if is_locked(e):
+                        # the rest would be too; roll back and try them all
+                        # again
+                        raise
+                    outcomes.append((future, None, e))
+        return outcomes
+
+writer = Writer()
+
+def submit(operation, *args, **kwargs):
+    return writer.submit(operation, *args, **kwargs)